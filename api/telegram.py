@@ -1,4 +1,10 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
@@ -13,6 +19,10 @@ from main import (
     add,
     list_tx,
     show_summary,
+    report,
+    reconcile,
+    export,
+    import_document,
     free_entry,
     ocr_photo,
     free_desc,
@@ -30,11 +40,55 @@ from main import (
     CATEGORY,
     TELEGRAM_BOT_TOKEN,
 )
+import metrics
+import persistence
+import spool
+from cache import TTLCache
+from dispatcher import ChatDispatcher
+
+# Acknowledge Telegram immediately and process in the background. Serverless
+# platforms (Vercel) may freeze the instance after the response, so there the
+# update is processed before returning unless explicitly enabled.
+WEBHOOK_FAST_ACK = os.getenv(
+    "WEBHOOK_FAST_ACK", "false" if os.getenv("VERCEL") else "true"
+).lower() in {"1", "true", "yes"}
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+# how long shutdown waits for acknowledged updates still queued in the dispatcher
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    # replay write-behind rows left by a previous run now rather than on the
+    # first save, and give queued rows a last flush on shutdown
+    if spool.WRITE_BEHIND:
+        spool.start()
+    try:
+        yield
+    finally:
+        # Telegram will not resend acknowledged updates: finish them (new ones
+        # get 503 and are retried) before the spool's final flush
+        await dispatcher.drain(WEBHOOK_DRAIN_TIMEOUT)
+        global _initialized
+        if _initialized:
+            _initialized = False
+            await application.shutdown()
+        if spool.WRITE_BEHIND:
+            await spool.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=_lifespan)
 
 # Build PTB application once at cold start
-application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+state = persistence.build()
+_builder = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN)
+if state is not None:
+    _builder = _builder.persistence(state)
+if (_request := metrics.bot_request()) is not None:
+    _builder = _builder.request(_request)
+application = _builder.build()
 
 conv = ConversationHandler(
     entry_points=[
@@ -50,6 +104,8 @@ conv = ConversationHandler(
         CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, free_category)],
     },
     fallbacks=[CommandHandler("cancel", free_cancel)],
+    name="free_entry",
+    persistent=state is not None,
 )
 
 application.add_handler(conv)
@@ -57,13 +113,89 @@ application.add_handler(CommandHandler("start", start))
 application.add_handler(CommandHandler("add", add))
 application.add_handler(CommandHandler("list", list_tx))
 application.add_handler(CommandHandler("summary", show_summary))
+application.add_handler(CommandHandler("report", report))
+application.add_handler(CommandHandler("reconcile", reconcile))
+application.add_handler(CommandHandler("export", export))
+application.add_handler(MessageHandler(filters.Document.ALL, import_document))
+if state is not None:
+    state.install(application)
+
+
+dispatcher = ChatDispatcher(
+    application.process_update, max_concurrency=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING
+)
+# update_ids already accepted; Telegram re-delivers when a webhook call is slow or fails
+_seen_updates = TTLCache(maxsize=10000, ttl=3600)
+
+
+_init_lock = asyncio.Lock()
+_initialized = False
+
+
+async def _ensure_initialized() -> None:
+    # Application.process_update refuses to run before initialize(), which
+    # also loads persisted conversations; done once, on the first update
+    global _initialized
+    if _initialized:
+        return
+    async with _init_lock:
+        if not _initialized:
+            await application.initialize()
+            _initialized = True
+
+
+def _chat_key(update: Update):
+    chat = update.effective_chat
+    if chat is not None:
+        return chat.id
+    user = update.effective_user
+    return ("user", user.id) if user is not None else ("update", update.update_id)
 
 
 @app.post("/")
 async def telegram_webhook(request: Request):
-    data = await request.json()
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return JSONResponse({"ok": False}, status_code=401)
+    try:
+        data = await request.json()
+        update_id = int(data["update_id"])
+    except Exception:
+        return JSONResponse({"ok": False, "error": "invalid update"}, status_code=400)
+    if _seen_updates.get(update_id):
+        return {"ok": True, "duplicate": True}
+    await _ensure_initialized()
     update = Update.de_json(data, application.bot)
-    await application.process_update(update)
+    if not WEBHOOK_FAST_ACK:
+        # marked seen only once processed, so Telegram's retry after a 500 runs it again
+        await application.process_update(update)
+        _seen_updates.set(update_id, True)
+        return {"ok": True}
+    if not dispatcher.submit(_chat_key(update), update):
+        # backlog full: let Telegram retry later
+        return JSONResponse({"ok": False, "error": "busy"}, status_code=503)
+    _seen_updates.set(update_id, True)
     return {"ok": True}
 
 
+@app.get("/stats")
+async def webhook_stats():
+    return {
+        "fast_ack": WEBHOOK_FAST_ACK,
+        "queue": dispatcher.stats(),
+        "state": state.stats() if state is not None else None,
+        # rows waiting for Supabase, and rows it rejected for good
+        "spool": {
+            "pending": await asyncio.to_thread(spool.pending_count),
+            "dead": await asyncio.to_thread(spool.dead_count),
+        } if spool.WRITE_BEHIND else None,
+        # OCR pool queue depth and waits; only if a photo already loaded it, so
+        # /stats never pulls in PIL/pytesseract
+        "ocr": sys.modules["ocr"].stats() if "ocr" in sys.modules else None,
+    }
+
+
+if metrics.ENABLED:
+    # only routed when enabled; otherwise /metrics is a plain 404
+    @app.get("/metrics")
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
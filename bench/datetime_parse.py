@@ -0,0 +1,170 @@
+"""Date input parsing and timestamp formatting: speed, and agreement with the old code.
+
+The ``_legacy_*`` functions are the strptime/strftime versions these helpers
+replaced. Hand-written and generated inputs are run through both; any
+difference fails the run (exit 1). Timings cover the inputs users actually
+type and rendering one /list page (10 rows) of DB timestamps.
+
+    python -m bench.datetime_parse --random 20000 --number 20000
+"""
+import argparse
+import os
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.bench.bench")
+
+import main as bot  # noqa: E402
+
+LOCAL_TZ = bot.LOCAL_TZ
+
+
+def _legacy_format_db_dt(dt: datetime) -> str:
+    aware = dt.astimezone(LOCAL_TZ)
+    s = aware.strftime("%Y-%m-%d %H:%M:%S%z")
+    if len(s) >= 5:
+        return s[:-2] + ":" + s[-2:]
+    return s
+
+
+def _legacy_now_iso() -> str:
+    return _legacy_format_db_dt(datetime.now(LOCAL_TZ).replace(microsecond=0))
+
+
+def _legacy_format_dt_for_display(value: str | None) -> str:
+    s = str(value or "")
+    if not s:
+        return "-"
+    try:
+        iso = s.replace("Z", "+00:00")
+        if "T" not in iso and "+" in iso:
+            iso = iso[:19].replace(" ", "T") + iso[19:]
+        dt = datetime.fromisoformat(iso)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(LOCAL_TZ)
+        return dt.strftime("%Y-%m-%d %H:%M")
+    except Exception:
+        return s.replace("T", " ")
+
+
+def _legacy_parse_datetime_input(text: str) -> str:
+    raw = (text or "").strip()
+    t = raw.lower()
+    if not t or t == "0" or t in {"hari ini", "today", "now"}:
+        return _legacy_now_iso()
+    if t in {"kemarin", "yesterday"}:
+        return _legacy_format_db_dt((datetime.now(LOCAL_TZ) - timedelta(days=1)).replace(microsecond=0))
+    s = raw.replace("/", "-").strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M"):
+        try:
+            dt = datetime.strptime(s, fmt).replace(microsecond=0)
+            dt = dt.replace(tzinfo=LOCAL_TZ)
+            return _legacy_format_db_dt(dt)
+        except Exception:
+            pass
+    for fmt in ("%Y-%m-%d", "%d-%m-%Y"):
+        try:
+            d = datetime.strptime(s, fmt).date()
+            return _legacy_format_db_dt(datetime(d.year, d.month, d.day, 0, 0, 0, tzinfo=LOCAL_TZ))
+        except Exception:
+            pass
+    raise ValueError("Format tanggal/waktu tidak dikenali. Contoh: 2025-10-30 14:30")
+
+
+def _outcome(fn, text):
+    try:
+        return fn(text)
+    except ValueError:
+        return None
+
+
+INPUTS = [
+    "", " ", "0", "now", "Today", "hari ini", "HARI INI", "kemarin", "Yesterday", "besok",
+    "2025-10-30", "30-10-2025", "2025/10/30", "30/10/2025", "2025-1-5", "5-1-2025",
+    "2025-10-30 14:30", "2025-10-30 14:30:59", "2025-10-30 14:30:60", "2025-10-30  7:05",
+    "2025-10-30\t7:05", "30-10-2025 23:59", "30-10-2025 24:00", "2025-02-29", "2024-02-29",
+    "2025-02-30", "2025-13-01", "0000-01-01", "2025-10-301", "2025-01- 5", "2025-10-30 14",
+    "2025-10-30T14:30", "30-10-25", "1-1-2025 1:1:1", "٢٠٢٥-١٠-٣٠", "2025-10-30 14:30 ",
+    "makan", "25000", "12:30",
+]
+
+
+def _random_inputs(n: int, seed: int = 20251030) -> list[str]:
+    rng = random.Random(seed)
+    pieces = ["2025", "1999", "0", "1", "09", "12", "13", "29", "30", "31", "-", "/", " ", ":", "5", "60"]
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(1, 10))) for _ in range(n)]
+
+
+def _random_timestamps(n: int, seed: int = 7) -> list[datetime]:
+    rng = random.Random(seed)
+    zones = [timezone.utc, LOCAL_TZ, timezone(timedelta(hours=-5)), timezone(timedelta(hours=5, minutes=30))]
+    base = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return [
+        (base + timedelta(seconds=rng.randrange(0, 130 * 365 * 86400))).astimezone(rng.choice(zones))
+        for _ in range(n)
+    ]
+
+
+def _differential(n: int) -> list[str]:
+    failures = []
+    for text in INPUTS + _random_inputs(n):
+        old, new = _outcome(_legacy_parse_datetime_input, text), _outcome(bot._parse_datetime_input, text)
+        # relative words resolve against the clock; retry once across a second boundary
+        if old != new and old != _outcome(bot._parse_datetime_input, text):
+            failures.append(f"parse {text!r}: legacy={old} new={new}")
+    for dt in _random_timestamps(n):
+        old, new = _legacy_format_db_dt(dt), bot._format_db_dt(dt)
+        if old != new:
+            failures.append(f"format_db_dt {dt}: legacy={old} new={new}")
+        for value in (dt.isoformat(), dt.isoformat().replace("+00:00", "Z"), old, dt.replace(tzinfo=None).isoformat()):
+            old_d, new_d = _legacy_format_dt_for_display(value), bot._format_dt_for_display(value)
+            if old_d != new_d:
+                failures.append(f"display {value!r}: legacy={old_d} new={new_d}")
+    for value in (None, "", "garbage", "2025-10-30T14:30:00.12+00:00"):
+        if _legacy_format_dt_for_display(value) != bot._format_dt_for_display(value):
+            failures.append(f"display {value!r}")
+    return failures
+
+
+def _per_call(fn, number: int) -> float:
+    return timeit.timeit(fn, number=number) / number * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--random", type=int, default=20000, help="generated inputs/timestamps")
+    ap.add_argument("--number", type=int, default=20000, help="timed calls per case")
+    args = ap.parse_args()
+
+    failures = _differential(args.random)
+    print(f"differential: {len(failures)} mismatches")
+    for f in failures[:20]:
+        print("  " + f)
+
+    print(f"{'case':<26} {'legacy µs':>10} {'new µs':>10} {'speedup':>8}")
+
+    def row(name, old, new):
+        o, n = _per_call(old, args.number), _per_call(new, args.number)
+        print(f"{name:<26} {o:10.2f} {n:10.2f} {o / n:7.1f}x")
+
+    for text in ("today", "kemarin", "30/10/2025", "2025-10-30 14:30", "30-10-2025 14:30:15", "makan"):
+        row(f"parse {text!r}", lambda: _outcome(_legacy_parse_datetime_input, text),
+            lambda: _outcome(bot._parse_datetime_input, text))
+
+    dt = datetime(2025, 10, 30, 14, 30, tzinfo=LOCAL_TZ)
+    row("format_db_dt", lambda: _legacy_format_db_dt(dt), lambda: bot._format_db_dt(dt))
+
+    page = [(datetime(2025, 10, 24, 7, 30, tzinfo=timezone.utc) - timedelta(hours=7 * i)).isoformat() for i in range(10)]
+    row("/list page (10 rows)", lambda: [_legacy_format_dt_for_display(v) for v in page],
+        lambda: [bot._format_dt_for_display(v) for v in page])
+    bot._format_dt_for_display.cache_clear()
+    row("/list page, uncached", lambda: [_legacy_format_dt_for_display(v) for v in page],
+        lambda: [bot._format_dt_for_display.__wrapped__(v) for v in page])
+
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Throughput of N simultaneous users hitting the data-access layer.
+
+Each simulated user issues ``--queries`` sequential requests whose blocking
+``execute()`` sleeps for ``--latency`` seconds (a stand-in for a PostgREST
+round trip). The run is repeated with the old inline ``execute()`` call and
+with ``db.execute`` so the effect on the event loop is visible.
+
+    python -m bench.db_concurrency --users 50 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.bench.bench")
+
+import db  # noqa: E402
+
+
+class _FakeQuery:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def execute(self):
+        time.sleep(self.latency)
+        return None
+
+
+async def _user_inline(q: _FakeQuery, n: int):
+    for _ in range(n):
+        q.execute()
+
+
+async def _user_pooled(q: _FakeQuery, n: int):
+    for _ in range(n):
+        await db.execute(q)
+
+
+async def _run(worker, users: int, queries: int, latency: float) -> float:
+    q = _FakeQuery(latency)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(q, queries) for _ in range(users)))
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--queries", type=int, default=3)
+    ap.add_argument("--latency", type=float, default=0.05)
+    args = ap.parse_args()
+
+    total = args.users * args.queries
+    print(f"users={args.users} queries/user={args.queries} latency={args.latency}s "
+          f"workers={db.DB_MAX_WORKERS}")
+    for label, worker in (("inline", _user_inline), ("db.execute", _user_pooled)):
+        elapsed = asyncio.run(_run(worker, args.users, args.queries, args.latency))
+        print(f"{label:>11}: {elapsed:7.2f}s  {total / elapsed:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Time and peak Python memory of /export for a user with many rows.
+
+The data layer is replaced by an in-memory keyset pager over synthetic rows,
+so only the export path itself (paging, formatting, gzip/XLSX writing) is
+measured; peak memory should stay flat as --rows grows.
+
+    python -m bench.export_stream --rows 100000 --format csv
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.bench.bench")
+
+import db  # noqa: E402
+import main as bot  # noqa: E402
+import taxonomy  # noqa: E402
+
+
+def _fake_pager(total: int):
+    async def list_transactions(user_id, limit=10, before=None, **_filters):
+        # rows are numbered newest-first; the cursor is (date, id) of the last row served
+        first = 0 if before is None else int(before[1]) + 1
+        return [
+            {
+                "id": f"{i:09d}",
+                "type": "outcome" if i % 3 else "income",
+                "amount": 12500 + i,
+                "description": f"Transaksi nomor {i}",
+                "transaction_date": "2025-10-24T07:30:00+00:00",
+                "bank_id": f"b{i % 5}",
+                "category_id": f"c{i % 12}",
+            }
+            for i in range(first, min(first + limit, total))
+        ]
+    return list_transactions
+
+
+async def _fake_names(table):
+    prefix, n = ("b", 5) if table == "bank" else ("c", 12)
+    return [{"id": f"{prefix}{i}", "name": f"{table}-{i}"} for i in range(n)]
+
+
+async def _run(fmt: str) -> int:
+    with tempfile.TemporaryFile() as out:
+        n = await bot._write_export(out, fmt, "bench-user")
+        out.seek(0, os.SEEK_END)
+        print(f"  file size: {out.tell() / 1024:.0f} KiB")
+        return n
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    args = ap.parse_args()
+
+    db.list_transactions = _fake_pager(args.rows)
+    db.fetch_id_names = _fake_names
+    taxonomy.invalidate()
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = asyncio.run(_run(args.format))
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {args.format}: {n} rows in {elapsed:.2f}s ({n / elapsed:,.0f} rows/s), "
+          f"peak traced memory {peak / 1024 / 1024:.1f} MiB (page size {bot.EXPORT_PAGE_SIZE})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Cold-start cost of the webhook entry point, measured with ``python -X importtime``.
+
+Each run imports ``api.telegram`` in a fresh interpreter (placeholder
+credentials, no network) and reads the cumulative import time from the
+``-X importtime`` report. It fails (exit 1) when the median exceeds
+``--budget-ms`` or when a module that should load lazily (OCR, Supabase
+SDK, XLSX) is imported eagerly.
+
+    python -m bench.import_time --runs 5 --budget-ms 1000
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGET = "api.telegram"
+# must not be imported just to serve a /start message
+LAZY_MODULES = ("PIL", "pytesseract", "supabase", "openpyxl", "ocr")
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+    env.setdefault("SUPABASE_URL", "http://localhost:54321")
+    env.setdefault("SUPABASE_SERVICE_KEY", "bench.bench.bench")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def _importtime() -> tuple[int, list[tuple[int, str]]]:
+    """(cumulative µs for TARGET, [(cumulative µs, module)] of its direct top-level imports)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET}"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    )
+    total = 0
+    top: list[tuple[int, str]] = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        cumulative, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        if name == TARGET:
+            total = cumulative
+        elif indent <= 3:
+            top.append((cumulative, name))
+    return total, top
+
+
+def _eager_modules() -> list[str]:
+    code = (
+        f"import sys, {TARGET}; "
+        f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=_env(), capture_output=True, text=True, check=True
+    ).stdout
+    return out.split()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=1000.0)
+    ap.add_argument("--top", type=int, default=8)
+    args = ap.parse_args()
+
+    totals = []
+    top: list[tuple[int, str]] = []
+    for _ in range(args.runs):
+        total, top = _importtime()
+        totals.append(total / 1000)
+    median = statistics.median(totals)
+    print(f"import {TARGET}: median {median:.0f} ms over {args.runs} runs "
+          f"(min {min(totals):.0f}, max {max(totals):.0f}); budget {args.budget_ms:.0f} ms")
+    print("heaviest top-level imports (last run):")
+    for us, name in sorted(top, reverse=True)[: args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    eager = _eager_modules()
+    ok = median <= args.budget_ms and not eager
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+    if median > args.budget_ms:
+        print("FAIL: over budget")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
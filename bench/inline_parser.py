@@ -0,0 +1,192 @@
+"""One-line entry parser: speed, and agreement with the previous implementation.
+
+``_legacy_try_parse_inline_full`` is the parser as it was before the
+single-pass lexer (shlex + strptime probes). Every line of a corpus of
+hand-written edge cases plus generated messages is parsed by both and the
+results compared; any difference fails the run (exit 1). The only accepted
+difference is where the legacy parser crashed with IndexError (a date
+consuming the category/bank slots) and the new one rejects the line.
+
+    python -m bench.inline_parser --random 20000 --number 20000
+"""
+import argparse
+import os
+import random
+import shlex
+import timeit
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.bench.bench")
+
+import main as bot  # noqa: E402
+
+
+def _legacy_try_parse_inline_full(text: str):
+    raw = (text or "").strip()
+    if not raw:
+        return None
+    try:
+        parts = shlex.split(raw)
+    except Exception:
+        return None
+    type_idx = None
+    for i, p in enumerate(parts):
+        lp = p.lower()
+        if lp in {"income", "outcome"}:
+            type_idx = i
+            break
+    if type_idx is None:
+        return None
+    if len(parts) < type_idx + 4:
+        return None
+    desc_tokens = parts[:type_idx]
+    if not desc_tokens:
+        return None
+    tx_type = parts[type_idx].lower()
+    amount_token = parts[type_idx + 1]
+    tx_at = None
+    cat_idx = type_idx + 2
+    try:
+        if cat_idx + 1 < len(parts):
+            probe2 = parts[cat_idx] + " " + parts[cat_idx + 1]
+            try:
+                tx_at = bot._parse_datetime_input(probe2)
+                cat_idx += 2
+            except Exception:
+                tx_at = None
+        if tx_at is None:
+            probe1 = parts[cat_idx]
+            tx_at = bot._parse_datetime_input(probe1)
+            cat_idx += 1
+    except Exception:
+        tx_at = None
+    category = parts[cat_idx]
+    bank = parts[cat_idx + 1] if len(parts) > cat_idx + 1 else None
+    if bank is None:
+        return None
+    try:
+        amount = bot._parse_amount(amount_token)
+    except Exception:
+        return None
+    desc = " ".join(desc_tokens)
+    if len(desc.strip()) < 3:
+        return None
+    return {
+        "desc": bot._first_sentence(desc),
+        "type": tx_type,
+        "amount": amount,
+        "tx_at": tx_at,
+        "category": category,
+        "bank": bank,
+    }
+
+
+CORPUS = [
+    "",
+    "   ",
+    "makan siang",
+    "makan siang 25000",
+    "Makan siang outcome 25000 Makan BCA",
+    "gaji income 10.000.000 Gaji Mandiri",
+    "gaji INCOME 10,000,000.50 Gaji Mandiri",
+    "ab outcome 1000 x y",
+    "abc outcome 1000 x y",
+    "outcome 1000 food bca",
+    "kopi outcome 18rb food",
+    "kopi outcome abc food bca",
+    "kopi outcome 18.000 2025-10-30 food bca",
+    "kopi outcome 18.000 2025-10-30 14:30 food bca",
+    "kopi outcome 18.000 2025-10-30 14:30:15 food bca",
+    "kopi outcome 18.000 30-10-2025 food bca",
+    "kopi outcome 18.000 30/10/2025 07:05 food bca",
+    "kopi outcome 18.000 2025-02-30 food bca",
+    "kopi outcome 18.000 2025-1-5 food bca",
+    "kopi outcome 18.000 2025-01- 5 food bca",
+    "kopi outcome 18.000 hari ini food bca",
+    "kopi outcome 18.000 kemarin food bca",
+    "kopi outcome 18.000 today food bca",
+    "kopi outcome 18.000 now food bca",
+    "kopi outcome 18.000 0 food bca",
+    "kopi outcome 18.000 '' food bca",
+    "kopi outcome 18.000 2025-10-30 14:30",
+    "kopi outcome 18.000 2025-10-30 14:30 food",
+    "kopi outcome 18.000 hari ini",
+    'kopi outcome 18.000 "Makan Minum" "Bank BCA"',
+    "kopi outcome 18.000 'Makan Minum' 'Bank BCA'",
+    'kopi "outcome" 18.000 food bca',
+    'kopi outcome 18.000 "2025-10-30 14:30" food bca',
+    'kopi outcome 18.000 "food bca',
+    "kopi outcome 18.000 food bca\\",
+    "kopi outcome 18.000 fo\\ od bca",
+    'kopi outcome 18.000 "fo\\"od" "b\\ca"',
+    "kopi\toutcome\t18.000\tfood\tbca",
+    "kopi\u00a0outcome 18.000 food bca",
+    "kopi outcome 18.000 food\u00a0bca",
+    "kopi. enak! outcome 18.000 food bca",
+    "income income 5000 a b",
+    "beli outcome outcome 5000 a b",
+    "#tag outcome 5000 a b",
+]
+
+_WORDS = [
+    "makan", "kopi", "gaji", "bensin", "Beli", "pulsa", "income", "outcome", "Income",
+    "25000", "25.000", "1,5", "Rp10.000", "abc", "2025-10-30", "30-10-2025", "2025/10/30",
+    "31-02-2025", "14:30", "7:05:09", "hari", "ini", "kemarin", "today", "0", "food",
+    "bca", "BNI", "'Bank BCA'", '"Makan Siang"', "''", '"', "\\", "x.y", "-", "/",
+]
+
+
+def _random_corpus(n: int, seed: int = 20251030) -> list[str]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        k = rng.randint(0, 9)
+        sep = rng.choice([" ", " ", " ", "  ", "\t"])
+        out.append(sep.join(rng.choice(_WORDS) for _ in range(k)))
+    return out
+
+
+def _compare(line: str) -> str | None:
+    """None if both parsers agree on ``line``, else a description of the difference."""
+    new = bot._try_parse_inline_full(line)
+    try:
+        old = _legacy_try_parse_inline_full(line)
+    except IndexError:
+        return None if new is None else f"legacy crashed, new accepted: {new}"
+    if old != new:
+        # 'now'/'kemarin' resolve against the clock; retry once across a second boundary
+        if old != bot._try_parse_inline_full(line):
+            return f"legacy={old} new={new}"
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--random", type=int, default=20000, help="generated corpus lines")
+    ap.add_argument("--number", type=int, default=20000, help="timed calls per parser and sample")
+    args = ap.parse_args()
+
+    corpus = CORPUS + _random_corpus(args.random)
+    failures = [(line, diff) for line in corpus if (diff := _compare(line)) is not None]
+    accepted = sum(bot._try_parse_inline_full(line) is not None for line in corpus)
+    print(f"differential: {len(corpus)} lines, {accepted} accepted, {len(failures)} mismatches")
+    for line, diff in failures[:20]:
+        print(f"  {line!r}: {diff}")
+
+    samples = {
+        "plain text": "makan siang di warteg 25000",
+        "full entry": "Makan siang outcome 25.000 Makan BCA",
+        "with datetime": "Makan siang outcome 25.000 2025-10-30 12:15 Makan BCA",
+        "quoted": 'Makan siang outcome 25.000 "Makan Minum" "Bank BCA"',
+    }
+    print(f"{'sample':<14} {'legacy µs':>10} {'new µs':>10} {'speedup':>8}")
+    for name, line in samples.items():
+        old = timeit.timeit(lambda: _legacy_try_parse_inline_full(line), number=args.number)
+        new = timeit.timeit(lambda: bot._try_parse_inline_full(line), number=args.number)
+        print(f"{name:<14} {old / args.number * 1e6:10.2f} {new / args.number * 1e6:10.2f} {old / new:7.1f}x")
+
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Regenerate the synthetic receipt screenshots in bench/corpus/images.
+
+Each receipt in bench/corpus/receipts.json with an ``image`` path is drawn
+as a phone screenshot: an app bar with a logo, the receipt lines, and a
+navigation bar at the bottom. Output is deterministic for a given font, so
+the checked-in PNGs only change when this script or the corpus does.
+
+    python -m bench.make_receipts
+"""
+import json
+import os
+
+from PIL import Image, ImageDraw, ImageFont
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+FONT_PATHS = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+)
+WIDTH = 720
+LINE_HEIGHT = 56
+APP_BAR = 180
+NAV_BAR = 220
+
+
+def _font(size: int):
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size=size)
+
+
+def _placed(lines: list[str]):
+    """(text, y, is_label) of each line as drawn below the app bar."""
+    y = APP_BAR + 40
+    for i, line in enumerate(lines):
+        is_label = i + 1 < len(lines) and not any(ch.isdigit() for ch in line) and len(line) < 20
+        yield line, y, is_label
+        y += LINE_HEIGHT
+
+
+def layout(lines: list[str]) -> list[tuple[str, int, int]]:
+    """(text, left, top, right, bottom) of each line's ink in the rendered image: a perfect layout pass."""
+    body, label = _font(30), _font(26)
+    out = []
+    for line, y, is_label in _placed(lines):
+        left, top, right, bottom = (label if is_label else body).getbbox(line)
+        out.append((line, 40 + left, y + top, 40 + right, y + bottom))
+    return out
+
+
+def render(lines: list[str]) -> Image.Image:
+    height = APP_BAR + 40 + LINE_HEIGHT * len(lines) + 40 + NAV_BAR
+    img = Image.new("RGB", (WIDTH, height), (245, 246, 250))
+    draw = ImageDraw.Draw(img)
+    # app bar with a logo: pixels OCR has to wade through but never needs
+    draw.rectangle((0, 0, WIDTH, APP_BAR), fill=(0, 84, 166))
+    draw.ellipse((30, 40, 130, 140), fill=(255, 255, 255))
+    draw.ellipse((55, 65, 105, 115), fill=(0, 84, 166))
+    draw.rectangle((160, 75, 420, 105), fill=(120, 170, 220))
+    body, label = _font(30), _font(26)
+    for line, y, is_label in _placed(lines):
+        draw.text((40, y), line, fill=(110, 110, 120) if is_label else (20, 20, 20), font=label if is_label else body)
+    # bottom navigation bar with icon placeholders
+    top = height - NAV_BAR
+    draw.rectangle((0, top, WIDTH, height), fill=(255, 255, 255))
+    draw.line((0, top, WIDTH, top), fill=(200, 200, 210), width=2)
+    for k in range(4):
+        x = 70 + k * 180
+        draw.rounded_rectangle((x, top + 50, x + 80, top + 130), radius=16, fill=(190, 195, 210))
+    return img
+
+
+def main():
+    with open(os.path.join(CORPUS_DIR, "receipts.json"), encoding="utf-8") as f:
+        corpus = json.load(f)
+    for case in corpus["receipts"]:
+        if not case.get("image"):
+            continue
+        path = os.path.join(CORPUS_DIR, case["image"])
+        render(case["text"].splitlines()).save(path, optimize=True)
+        print(f"{path}: {os.path.getsize(path)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Speed and accuracy of the amount/description/receipt heuristics, against a baseline.
+
+Runs offline over the checked-in corpus (bench/corpus/receipts.json and the
+screenshots in bench/corpus/images):
+
+* per-function latency p50/p95 for ``_parse_amount``, ``_try_parse_inline_full``,
+  ``_pick_amount_from_text``, ``receipts.detect``, ``receipts.parse``,
+  ``ocr.parse_fields`` and the image steps ``ocr.recognize`` runs before
+  Tesseract (``enhance``, the full-page ``upscale`` and the ROI ``stack`` of
+  the planned regions); ``detect_64_formats`` repeats
+  the detection with 56 extra dummy formats registered, to show dispatch cost
+  does not grow with the registry;
+* extraction accuracy (bank, amount, description) from the OCR texts;
+* pixels handed to Tesseract per receipt, full-page (``OCR_ROI=false``)
+  versus region-of-interest mode. Without Tesseract the regions are planned
+  from the renderer's own line boxes (bench.make_receipts.layout), i.e. a
+  perfect layout pass;
+* with Tesseract installed, ``ocr.recognize`` on the images too: latency,
+  Tesseract invocations per image and accuracy. Without it that part is
+  skipped, not failed.
+
+The run fails (exit 1) when a p95 is more than ``--tolerance`` slower than
+bench/corpus/baseline.json, when an accuracy drops below it, or when OCR
+needs more Tesseract passes or pixels per image. ``--update-baseline`` records the
+current numbers instead.
+
+    python -m bench.ocr_heuristics
+    python -m bench.ocr_heuristics --update-baseline
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import time
+from decimal import Decimal
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench.bench.bench")
+
+from PIL import Image  # noqa: E402
+
+import main as bot  # noqa: E402
+import ocr  # noqa: E402
+import parsing  # noqa: E402
+import receipts  # noqa: E402
+from bench import make_receipts  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+BASELINE_PATH = os.path.join(CORPUS_DIR, "baseline.json")
+
+
+def _load_corpus() -> dict:
+    with open(os.path.join(CORPUS_DIR, "receipts.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _norm(s) -> str:
+    return " ".join(str(s or "").split()).casefold()
+
+
+def _dec(s) -> Decimal | None:
+    return Decimal(s) if s is not None else None
+
+
+def _latency(fn, inputs: list, repeat: int) -> dict:
+    """p50/p95 wall time per call in µs over ``repeat`` rounds of ``inputs``."""
+    samples = []
+    for _ in range(repeat):
+        for x in inputs:
+            t0 = time.perf_counter_ns()
+            fn(x)
+            samples.append((time.perf_counter_ns() - t0) / 1000)
+    samples.sort()
+    return {
+        "p50": round(statistics.median(samples), 2),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+    }
+
+
+def _ratio(hits: int, total: int) -> float:
+    return round(hits / total, 4) if total else 0.0
+
+
+def _fields_accuracy(results: list[tuple[dict, object]]) -> dict:
+    """Share of receipts whose bank, amount and description match the expectation."""
+    bank = amount = desc = 0
+    for expected, res in results:
+        bank += (res.bank_hint or "").casefold() == expected["bank"].casefold()
+        amount += res.amount is not None and res.amount == _dec(expected["amount"])
+        desc += _norm(res.desc) == _norm(expected["desc"])
+    n = len(results)
+    return {"bank": _ratio(bank, n), "amount": _ratio(amount, n), "desc": _ratio(desc, n)}
+
+
+def _text_result(text: str):
+    words = [ocr.Word(w, 90.0, 0, 0, 0, 0) for w in text.split()]
+    return ocr.parse_fields(ocr.OcrResult(text=text, words=words))
+
+
+def _inline_matches(got: dict | None, expected: dict | None) -> bool:
+    if got is None or expected is None:
+        return got is expected
+    return all(
+        (got[k] == _dec(v)) if k == "amount" else (got[k] == v) for k, v in expected.items()
+    )
+
+
+def _detect_with_extra_formats(texts: list[str], repeat: int, extra: int) -> dict:
+    """``receipts.detect`` latency with ``extra`` dummy formats registered next to the real ones."""
+    saved = dict(receipts._REGISTRY)
+    try:
+        for i in range(extra):
+            receipts.register(receipts.ReceiptFormat(f"Bank{i}", (f"BANK DUMMY {i}", f"DMY{i:03d}", f"WALLET{i}")))
+        return _latency(receipts.detect, texts, repeat)
+    finally:
+        receipts._REGISTRY.clear()
+        receipts._REGISTRY.update(saved)
+        receipts._scanner = None
+
+
+def measure_text(corpus: dict, repeat: int) -> dict:
+    cases = corpus["receipts"]
+    texts = [r["text"] for r in cases]
+    amounts = corpus["amounts"]
+    inline = corpus["inline"]
+
+    def parse_amount_or_none(s):
+        try:
+            return parsing._parse_amount(s)
+        except Exception:
+            return None
+
+    latency = {
+        "parse_amount": _latency(parse_amount_or_none, [a for a, _ in amounts], repeat),
+        "try_parse_inline_full": _latency(bot._try_parse_inline_full, [line for line, _ in inline], repeat),
+        "pick_amount_from_text": _latency(parsing._pick_amount_from_text, texts, repeat),
+        "detect": _latency(receipts.detect, texts, repeat),
+        "detect_64_formats": _detect_with_extra_formats(texts, repeat, 64 - len(receipts.formats())),
+        "receipt_parse": _latency(receipts.parse, texts, repeat),
+        "parse_fields": _latency(_text_result, texts, repeat),
+    }
+    accuracy = {
+        "parse_amount": _ratio(sum(parse_amount_or_none(a) == _dec(e) for a, e in amounts), len(amounts)),
+        "try_parse_inline_full": _ratio(
+            sum(_inline_matches(bot._try_parse_inline_full(line), e) for line, e in inline), len(inline)
+        ),
+        "pick_amount_from_text": _ratio(
+            sum(parsing._pick_amount_from_text(r["text"]) == _dec(r["expected"]["amount"]) for r in cases),
+            len(cases),
+        ),
+        "receipt_parse": _ratio(
+            sum(
+                (parsed := receipts.parse(r["text"]))["amount"] == _dec(r["expected"]["amount"])
+                and _norm(parsed["desc"]) == _norm(r["expected"]["desc"])
+                for r in cases
+            ),
+            len(cases),
+        ),
+    }
+    for key, value in _fields_accuracy([(r["expected"], _text_result(r["text"])) for r in cases]).items():
+        accuracy[f"text_{key}"] = value
+    return {"latency_us": latency, "accuracy": accuracy}
+
+
+def _tesseract_available() -> bool:
+    if not shutil.which(getattr(ocr.pytesseract.pytesseract, "tesseract_cmd", "tesseract")):
+        return False
+    try:
+        ocr.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def measure_images(corpus: dict, repeat: int) -> dict:
+    cases = [r for r in corpus["receipts"] if r.get("image")]
+    images = []
+    for r in cases:
+        with Image.open(os.path.join(CORPUS_DIR, r["image"])) as img:
+            img.load()
+            images.append(img)
+    n = max(1, len(images))
+    bases = [ocr._enhance(img) for img in images]
+    full = [ocr._scaled(b, ocr._upscale_factor(b.size)) for b in bases]
+    regions = [
+        ocr.plan_regions(make_receipts.layout(r["text"].splitlines()), img.size)
+        for r, img in zip(cases, images)
+    ]
+    planned = [ocr.roi_pixels(img.size, reg) for img, reg in zip(images, regions)]
+    stackable = [(b, reg) for b, reg in zip(bases, regions) if reg]
+    out = {
+        "latency_us": {
+            "enhance": _latency(ocr._enhance, images, repeat),
+            "upscale": _latency(lambda b: ocr._scaled(b, ocr._upscale_factor(b.size)), bases, repeat),
+            "roi_stack": _latency(lambda br: ocr._stack(br[0], br[1], ocr._upscale_factor(br[0].size)), stackable, repeat),
+        },
+        "images": len(images),
+        "pixels_per_image": sum(i.width * i.height for i in images) // n,
+        "ocr_pixels_per_image": {
+            "full": sum(g.width * g.height for g in full) // n,
+            "roi": sum(planned) // n,
+            "layout": "rendered",
+        },
+    }
+    if not _tesseract_available():
+        out["tesseract"] = None
+        return out
+
+    calls = {"n": 0}
+    real = ocr.pytesseract.image_to_data
+
+    def counting(*args, **kwargs):
+        calls["n"] += 1
+        return real(*args, **kwargs)
+
+    ocr.pytesseract.image_to_data = counting
+    roi_mode = ocr.OCR_ROI
+    try:
+        results = [ocr.recognize(img) for img in images]
+        invocations = calls["n"]
+        out["latency_us"]["recognize"] = _latency(ocr.recognize, images, 1)
+        ocr.OCR_ROI = False
+        full_pixels = [ocr.recognize(img).pixels for img in images]
+    finally:
+        ocr.pytesseract.image_to_data = real
+        ocr.OCR_ROI = roi_mode
+    if roi_mode:
+        out["ocr_pixels_per_image"] = {
+            "full": sum(full_pixels) // n,
+            "roi": sum(r.pixels for r in results) // n,
+            "layout": "tesseract",
+        }
+    out["tesseract"] = {
+        "calls_per_image": round(invocations / len(images), 2),
+        "accuracy": {
+            f"image_{k}": v for k, v in _fields_accuracy([(r["expected"], res) for r, res in zip(cases, results)]).items()
+        },
+    }
+    return out
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions of ``current`` against ``baseline``; metrics missing on either side are skipped."""
+    problems = []
+    latency = {**current["text"]["latency_us"], **current["images"]["latency_us"]}
+    base_latency = {**baseline.get("text", {}).get("latency_us", {}), **baseline.get("images", {}).get("latency_us", {})}
+    for name, base in base_latency.items():
+        now = latency.get(name)
+        if now and now["p95"] > base["p95"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {now['p95']:.1f} µs vs baseline {base['p95']:.1f} µs")
+    accuracy = dict(current["text"]["accuracy"])
+    base_accuracy = dict(baseline.get("text", {}).get("accuracy", {}))
+    tess, base_tess = current["images"].get("tesseract"), baseline.get("images", {}).get("tesseract")
+    if tess and base_tess:
+        accuracy.update(tess["accuracy"])
+        base_accuracy.update(base_tess["accuracy"])
+        if tess["calls_per_image"] > base_tess["calls_per_image"]:
+            problems.append(
+                f"tesseract calls/image {tess['calls_per_image']} vs baseline {base_tess['calls_per_image']}"
+            )
+    roi = current["images"].get("ocr_pixels_per_image", {})
+    base_roi = baseline.get("images", {}).get("ocr_pixels_per_image", {})
+    if roi.get("layout") == base_roi.get("layout") and roi.get("roi", 0) > base_roi.get("roi", float("inf")) * (
+        1 + tolerance
+    ):
+        problems.append(f"OCR pixels/image {roi['roi']} vs baseline {base_roi['roi']}")
+    for name, base in base_accuracy.items():
+        if name in accuracy and accuracy[name] < base:
+            problems.append(f"accuracy {name}: {accuracy[name]:.2%} vs baseline {base:.2%}")
+    return problems
+
+
+def _report(current: dict) -> None:
+    print(f"{'function':<24} {'p50 µs':>10} {'p95 µs':>10}")
+    for name, v in {**current["text"]["latency_us"], **current["images"]["latency_us"]}.items():
+        print(f"{name:<24} {v['p50']:10.1f} {v['p95']:10.1f}")
+    print("accuracy:")
+    for name, v in current["text"]["accuracy"].items():
+        print(f"  {name:<24} {v:7.2%}")
+    images = current["images"]
+    print(f"images: {images['images']}, {images['pixels_per_image']} px each")
+    px = images["ocr_pixels_per_image"]
+    print(
+        f"pixels to Tesseract per image ({px['layout']} layout): full page {px['full']}, "
+        f"ROI {px['roi']} ({px['roi'] / max(1, px['full']):.0%})"
+    )
+    tess = images.get("tesseract")
+    if tess is None:
+        print("tesseract: not installed, OCR part skipped")
+        return
+    print(f"tesseract calls per image: {tess['calls_per_image']}")
+    for name, v in tess["accuracy"].items():
+        print(f"  {name:<24} {v:7.2%}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=200, help="rounds over the text corpus")
+    ap.add_argument("--image-repeat", type=int, default=3, help="rounds over the images")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="allowed p95 slowdown (0.5 = +50%%)")
+    ap.add_argument("--update-baseline", action="store_true")
+    args = ap.parse_args()
+
+    corpus = _load_corpus()
+    current = {"text": measure_text(corpus, args.repeat), "images": measure_images(corpus, args.image_repeat)}
+    _report(current)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {BASELINE_PATH}")
+        return
+    if not os.path.exists(BASELINE_PATH):
+        print("no baseline yet; run with --update-baseline")
+        return
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = compare(current, baseline, args.tolerance)
+    for p in problems:
+        print("REGRESSION: " + p)
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Supabase data access for the bot.
+
+Every PostgREST round trip goes through this module. The supabase SDK client
+is synchronous, so requests are executed on a bounded thread pool and awaited
+from the handlers; the event loop keeps serving other chats meanwhile.
+The SDK is imported and the client built on first use, not at import time.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# Upper bound on concurrent PostgREST requests from this process
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+
+_sb = None
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+
+def client():
+    """The shared supabase client; created on first call and kept warm afterwards."""
+    global _sb
+    if _sb is None:
+        from supabase import create_client
+        _sb = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    return _sb
+
+
+async def execute(query):
+    """Run a request builder's blocking ``execute()`` on the DB thread pool."""
+    loop = asyncio.get_running_loop()
+    if not metrics.ENABLED:
+        return await loop.run_in_executor(_executor, query.execute)
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, query.execute)
+    finally:
+        metrics.observe_supabase(time.perf_counter() - started)
+
+
+def _first_id(res) -> str | None:
+    try:
+        if res.data and isinstance(res.data, list) and "id" in res.data[0]:
+            return res.data[0]["id"]
+    except Exception:
+        pass
+    return None
+
+
+# ---------- app_user ----------
+async def fetch_app_user_id(telegram_id: int) -> str | None:
+    res = await execute(client().table("app_user").select("id").eq("telegram_id", telegram_id).limit(1))
+    return _first_id(res)
+
+
+async def insert_app_user(payload: dict) -> str | None:
+    """Insert a user; returns None if the telegram_id already exists."""
+    q = client().table("app_user").upsert(payload, on_conflict="telegram_id", ignore_duplicates=True)
+    return _first_id(await execute(q))
+
+
+# ---------- bank / category ----------
+async def fetch_id_by_name(table: str, name: str, user_id: str | None = None) -> str | None:
+    q = client().table(table).select("id").eq("name", name)
+    if user_id is not None:
+        q = q.eq("user_id", user_id)
+    return _first_id(await execute(q.limit(1)))
+
+
+async def insert_named(table: str, payload: dict) -> str | None:
+    return _first_id(await execute(client().table(table).insert(payload)))
+
+
+async def fetch_id_names(table: str) -> list[dict]:
+    res = await execute(client().table(table).select("id, name").order("name"))
+    return res.data or []
+
+
+async def upsert_name(table: str, name: str) -> str | None:
+    """Create ``name`` if missing and return its id in one round trip."""
+    return _first_id(await execute(client().table(table).upsert({"name": name}, on_conflict="name")))
+
+
+async def upsert_names(table: str, names: list[str]) -> list[dict]:
+    """Create any missing ``names`` in one request; returns ``id, name`` rows."""
+    if not names:
+        return []
+    res = await execute(client().table(table).upsert([{"name": n} for n in names], on_conflict="name"))
+    return res.data or []
+
+
+# ---------- transaction ----------
+async def insert_transaction(payload: dict) -> None:
+    await execute(client().table("transaction").insert(payload))
+
+
+async def insert_transactions(payloads: list[dict]) -> None:
+    """Multi-row insert; one request for the whole batch."""
+    if payloads:
+        await execute(client().table("transaction").insert(payloads, returning="minimal"))
+
+
+def rejects_row(exc: Exception) -> bool:
+    """True if PostgREST refused the data itself (SQLSTATE class 22 or 23: bad
+    value, FK/check/not-null violation), so retrying the same row cannot help."""
+    code = getattr(exc, "code", None)
+    return isinstance(code, str) and len(code) == 5 and code[:2] in {"22", "23"}
+
+
+async def upsert_transactions(payloads: list[dict]) -> None:
+    """Multi-row insert that skips rows whose ``id`` already exists (safe to replay)."""
+    if payloads:
+        await execute(
+            client().table("transaction").upsert(
+                payloads, on_conflict="id", ignore_duplicates=True, returning="minimal"
+            )
+        )
+
+
+async def list_transactions(
+    user_id: str,
+    limit: int = 10,
+    before: tuple[str, str] | None = None,
+    tx_type: str | None = None,
+    bank_id: str | None = None,
+    category_id: str | None = None,
+    start: str | None = None,
+    end: str | None = None,
+) -> list[dict]:
+    """Newest-first page of a user's transactions.
+
+    Keyset paging: ``before`` is the ``(transaction_date, id)`` of the last
+    row of the previous page, so every page costs the same index range scan.
+    """
+    q = (
+        client().table("transaction")
+        .select("id, type, amount, description, transaction_date, bank_id, category_id")
+        .eq("user_id", user_id)
+    )
+    if tx_type:
+        q = q.eq("type", tx_type)
+    if bank_id:
+        q = q.eq("bank_id", bank_id)
+    if category_id:
+        q = q.eq("category_id", category_id)
+    if start:
+        q = q.gte("transaction_date", start)
+    if end:
+        q = q.lt("transaction_date", end)
+    if before:
+        ts, row_id = before
+        q = q.or_(f'transaction_date.lt."{ts}",and(transaction_date.eq."{ts}",id.lt.{row_id})')
+    res = await execute(
+        q.order("transaction_date", desc=True).order("id", desc=True).limit(limit)
+    )
+    return res.data or []
+
+
+async def transaction_summary(user_id: str, start: str | None = None, end: str | None = None) -> dict:
+    """Income/outcome/balance aggregated in Postgres (sql/001_transaction_summary.sql)."""
+    res = await execute(client().rpc("transaction_summary", {"p_user_id": user_id, "p_from": start, "p_to": end}))
+    rows = res.data or []
+    return rows[0] if rows else {}
+
+
+
+async def transaction_report(user_id: str, start: str | None = None, end: str | None = None) -> list[dict]:
+    """Per-category and per-bank totals (sql/003_transaction_report.sql)."""
+    res = await execute(client().rpc("transaction_report", {"p_user_id": user_id, "p_from": start, "p_to": end}))
+    return res.data or []
+
+# ---------- balances (sql/002_user_balance.sql) ----------
+async def user_balance(user_id: str) -> dict:
+    res = await execute(
+        client().table("user_balance").select("income, outcome, balance").eq("user_id", user_id).limit(1)
+    )
+    return res.data[0] if res.data else {}
+
+
+async def user_balance_version(user_id: str) -> str | None:
+    """``user_balance.updated_at``: the trigger moves it on every change to the user's transactions."""
+    res = await execute(client().table("user_balance").select("updated_at").eq("user_id", user_id).limit(1))
+    return res.data[0]["updated_at"] if res.data else None
+
+
+async def user_balance_month(user_id: str, month: str) -> dict:
+    """Totals for the month starting on ``month`` (YYYY-MM-01)."""
+    res = await execute(
+        client().table("user_balance_month")
+        .select("income, outcome, balance")
+        .eq("user_id", user_id)
+        .eq("month", month)
+        .limit(1)
+    )
+    return res.data[0] if res.data else {}
+
+
+async def reconcile_balances(user_id: str | None = None) -> list[dict]:
+    """Rebuild running totals from ``transaction``; returns the rows that had drifted."""
+    res = await execute(client().rpc("user_balance_reconcile", {"p_user_id": user_id}))
+    return res.data or []
+
+
+# ---------- bot_state (sql/005_bot_state.sql) ----------
+async def fetch_state(keys: list[str]) -> dict[str, object]:
+    """``key -> value`` for the stored conversation/user_data rows among ``keys``."""
+    if not keys:
+        return {}
+    res = await execute(client().table("bot_state").select("key, value").in_("key", keys))
+    return {row["key"]: row["value"] for row in res.data or []}
+
+
+async def upsert_state(rows: list[dict]) -> None:
+    if rows:
+        await execute(client().table("bot_state").upsert(rows, on_conflict="key", returning="minimal"))
+
+
+async def delete_state(keys: list[str]) -> None:
+    if keys:
+        await execute(client().table("bot_state").delete(returning="minimal").in_("key", keys))
@@ -0,0 +1,92 @@
+"""Background processing of webhook updates: ordered per chat, concurrent across chats.
+
+Each chat gets its own FIFO that is drained by one task at a time, so a
+chat's ConversationHandler sees its updates in order; different chats run
+concurrently up to ``max_concurrency``. Acknowledged updates live only in
+memory, so :meth:`ChatDispatcher.drain` must run before the process exits.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class ChatDispatcher:
+    def __init__(self, handler, max_concurrency: int = 16, max_pending: int = 1000):
+        self._handler = handler  # async callable(item)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._queues: dict = {}
+        # drain tasks, referenced until done so they cannot be garbage-collected mid-update
+        self._tasks: set[asyncio.Task] = set()
+        self.closed = False
+        self._sem: asyncio.Semaphore | None = None
+        self.pending = 0
+        self.processed = 0
+        self.rejected = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._lag_total = 0.0
+        self._started = 0
+
+    def submit(self, key, item) -> bool:
+        """Queue ``item`` behind earlier items of the same ``key``; False if full or draining."""
+        if self.closed or self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        q = self._queues.get(key)
+        if q is None:
+            q = self._queues[key] = deque()
+            task = asyncio.get_running_loop().create_task(self._drain(key, q))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        q.append((time.monotonic(), item))
+        self.pending += 1
+        return True
+
+    async def _drain(self, key, q: deque) -> None:
+        try:
+            while q:
+                enqueued, item = q[0]
+                async with self._sem:
+                    lag = time.monotonic() - enqueued
+                    self.lag_last = lag
+                    self.lag_max = max(self.lag_max, lag)
+                    self._lag_total += lag
+                    self._started += 1
+                    try:
+                        await self._handler(item)
+                    except Exception:
+                        logging.exception("update processing failed")
+                q.popleft()
+                self.pending -= 1
+                self.processed += 1
+        finally:
+            if self._queues.get(key) is q:
+                del self._queues[key]
+
+    async def drain(self, timeout: float) -> bool:
+        """Stop accepting items and wait up to ``timeout`` seconds for the queued ones.
+
+        Returns False (and logs what is lost) if some were still pending.
+        """
+        self.closed = True
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        if self.pending:
+            logging.warning("dispatcher: %d update(s) still pending after %.0fs", self.pending, timeout)
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "active_chats": len(self._queues),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "lag_last": self.lag_last,
+            "lag_max": self.lag_max,
+            "lag_avg": self._lag_total / self._started if self._started else 0.0,
+        }
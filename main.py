@@ -1,16 +1,19 @@
+import asyncio
+import csv
+import gzip
+import io
 import os
 import logging
 import re
 import tempfile
+import time
+from calendar import monthrange
 from datetime import date, datetime, timedelta
-from decimal import Decimal, InvalidOperation, ROUND_DOWN
+from functools import lru_cache
+from decimal import Decimal
 from dotenv import load_dotenv
 from zoneinfo import ZoneInfo
 
-from supabase import create_client, Client
-from PIL import Image, ImageOps, ImageEnhance, ImageFilter
-import pytesseract
-from pytesseract import Output
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import (
@@ -22,28 +25,45 @@ from telegram.ext import (
     filters,
 )
 
+import db
+import metrics
+import persistence
+import receipts
+import spool
+import taxonomy
+from cache import TTLCache
+from parsing import (
+    _parse_amount,
+    _first_sentence,
+    _normalize_ocr_amount,
+    _split_words,
+)
+
 load_dotenv()
 DEBUG_OCR = os.getenv("DEBUG_OCR", "").lower() in {"1", "true", "yes"}
 DEBUG_OCR = os.getenv("DEBUG_OCR", "").lower() in {"1", "true", "yes"}
 logging.basicConfig(level=logging.INFO)
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 APP_TIMEZONE = os.getenv("APP_TIMEZONE", "Asia/Jakarta")
 LOCAL_TZ = ZoneInfo(APP_TIMEZONE)
+APP_USER_CACHE_TTL = float(os.getenv("APP_USER_CACHE_TTL", "900"))
+APP_USER_CACHE_SIZE = int(os.getenv("APP_USER_CACHE_SIZE", "10000"))
+
+# telegram_id -> app_user.id
+_app_user_ids = TTLCache(maxsize=APP_USER_CACHE_SIZE, ttl=APP_USER_CACHE_TTL)
+# one in-flight lookup/create per telegram_id, so concurrent first messages don't race
+_app_user_locks: dict[int, asyncio.Lock] = {}
 
-sb: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# (app_user.id, user_balance.updated_at, start, end) -> /report rows. The
+# version comes from the database, so a write through any instance (or the
+# write-behind spool reaching Supabase) orphans every instance's cached reports.
+_report_cache = TTLCache(maxsize=1024, ttl=float(os.getenv("REPORT_CACHE_TTL", "3600")))
 
 # ---------- Helpers ----------
 def _format_db_dt(dt: datetime) -> str:
     """Format aware datetime to 'YYYY-MM-DD HH:MM:SS+07:00'."""
-    aware = dt.astimezone(LOCAL_TZ)
-    s = aware.strftime("%Y-%m-%d %H:%M:%S%z")  # e.g., +0700
-    if len(s) >= 5:
-        # add colon to timezone offset: +0700 -> +07:00
-        return s[:-2] + ":" + s[-2:]
-    return s
+    return dt.astimezone(LOCAL_TZ).isoformat(sep=" ", timespec="seconds")
 
 def _now_iso() -> str:
     """Return current timestamp with local timezone offset for DB storage."""
@@ -52,58 +72,75 @@ def _now_iso() -> str:
 async def get_or_create_app_user_id(update: Update) -> str:
     tg = update.effective_user
     telegram_id = int(getattr(tg, "id", 0))
-    username = getattr(tg, "username", None)
-    first_name = getattr(tg, "first_name", None)
-    last_name = getattr(tg, "last_name", None)
+    cached = _app_user_ids.get(telegram_id)
+    if cached:
+        return cached
+    lock = _app_user_locks.setdefault(telegram_id, asyncio.Lock())
+    try:
+        async with lock:
+            # another update from the same user may have filled it while we waited
+            cached = _app_user_ids.get(telegram_id)
+            if cached:
+                return cached
+            app_user_id = await _fetch_or_create_app_user_id(tg, telegram_id)
+            _app_user_ids.set(telegram_id, app_user_id)
+            return app_user_id
+    finally:
+        if not lock.locked():
+            _app_user_locks.pop(telegram_id, None)
+
+async def _fetch_or_create_app_user_id(tg, telegram_id: int) -> str:
     # try get
-    res = sb.table("app_user").select("id").eq("telegram_id", telegram_id).limit(1).execute()
-    if res.data:
-        return res.data[0]["id"]
-    # else create
-    ins = sb.table("app_user").insert({
+    found = await db.fetch_app_user_id(telegram_id)
+    if found:
+        return found
+    # else create (no-op if another instance created it first)
+    created = await db.insert_app_user({
         "telegram_id": telegram_id,
-        "username": username,
-        "first_name": first_name,
-        "last_name": last_name,
-    }).execute()
-    try:
-        if ins.data and isinstance(ins.data, list) and ins.data and "id" in ins.data[0]:
-            return ins.data[0]["id"]
-    except Exception:
-        pass
-    res2 = sb.table("app_user").select("id").eq("telegram_id", telegram_id).limit(1).execute()
-    if res2.data:
-        return res2.data[0]["id"]
+        "username": getattr(tg, "username", None),
+        "first_name": getattr(tg, "first_name", None),
+        "last_name": getattr(tg, "last_name", None),
+    })
+    if created:
+        return created
+    found = await db.fetch_app_user_id(telegram_id)
+    if found:
+        return found
     raise RuntimeError("Gagal membuat/menemukan user aplikasi")
 
 async def get_or_create_id(table: str, name: str, user_id: str | None = None) -> str:
+    if user_id is None:
+        # shared taxonomy: cached map, misses are a single upsert
+        return await taxonomy.resolve_id(table, name)
     # try get
-    q = sb.table(table).select("id").eq("name", name)
-    if user_id is not None:
-        q = q.eq("user_id", user_id)
-    res = q.limit(1).execute()
-    if res.data:
-        return res.data[0]["id"]
+    found = await db.fetch_id_by_name(table, name, user_id)
+    if found:
+        return found
     # else create
     payload = {"name": name}
     if user_id is not None:
         payload["user_id"] = user_id
-    ins = sb.table(table).insert(payload).execute()
     # Prefer returned id if server returns representation
-    try:
-        if ins.data and isinstance(ins.data, list) and ins.data and "id" in ins.data[0]:
-            return ins.data[0]["id"]
-    except Exception:
-        pass
+    created = await db.insert_named(table, payload)
+    if created:
+        return created
     # Fallback: fetch the newly inserted row
-    q2 = sb.table(table).select("id").eq("name", name)
-    if user_id is not None:
-        q2 = q2.eq("user_id", user_id)
-    res2 = q2.limit(1).execute()
-    if res2.data:
-        return res2.data[0]["id"]
+    found = await db.fetch_id_by_name(table, name, user_id)
+    if found:
+        return found
     raise RuntimeError(f"Gagal membuat {table} '{name}'")
 
+async def _save_transaction(payload: dict) -> None:
+    """Single write path for new transactions.
+
+    With WRITE_BEHIND the row is only spooled locally (durably) here and sent
+    to Supabase by the background writer.
+    """
+    if spool.WRITE_BEHIND:
+        await spool.enqueue(payload)
+    else:
+        await db.insert_transaction(payload)
+
 def parse_kv_args(text: str) -> dict:
     """
     Parse /add bank=BCA category=Gaji type=income desc="Gaji bulan ini"
@@ -119,9 +156,11 @@ def parse_kv_args(text: str) -> dict:
     return out
 
 # ---------- Handlers ----------
+@metrics.timed
 async def start(update: Update, _: ContextTypes.DEFAULT_TYPE):
     await _show_menu(update)
 
+@metrics.timed
 async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = await get_or_create_app_user_id(update)
@@ -158,7 +197,7 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "transaction_date": tx_at or _now_iso(),
             "user_id": user_id,
         }
-        sb.table("transaction").insert(payload).execute()
+        await _save_transaction(payload)
 
         ts = _format_dt_for_display(tx_at or _now_iso())
         await update.message.reply_text(
@@ -186,94 +225,67 @@ def _format_rp(amount: float | int | Decimal | None) -> str:
         return f"{sign}Rp {s}"
     return f"{sign}Rp {s},{r:02d}"
 
+@lru_cache(maxsize=4096)
 def _format_dt_for_display(value: str | None) -> str:
+    """'YYYY-MM-DD HH:MM' in local time for a DB timestamp (cached: /list re-renders the same rows)."""
     s = str(value or "")
     if not s:
         return "-"
     try:
-        # Normalize to ISO for parser and display in local timezone
-        iso = s.replace("Z", "+00:00")
-        if "T" not in iso and "+" in iso:
-            # turn 'YYYY-MM-DD HH:MM:SS+07:00' into ISO '...T...'
-            idx = iso.find("+")
-            iso = iso[:19].replace(" ", "T") + iso[19:]
-        dt = datetime.fromisoformat(iso)
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
         if dt.tzinfo is not None:
             dt = dt.astimezone(LOCAL_TZ)
-        return dt.strftime("%Y-%m-%d %H:%M")
-    except Exception:
+    except (ValueError, OverflowError):
         return s.replace("T", " ")
+    return dt.isoformat(sep=" ", timespec="minutes")[:16]
+
+# Same patterns (and first-match semantics) as datetime.strptime for
+# %Y-%m-%d / %d-%m-%Y with optional ' %H:%M[:%S]', tried in the same order.
+_Y = r"(?P<Y>\d\d\d\d)"
+_M = r"(?P<m>1[0-2]|0[1-9]|[1-9])"
+_D = r"(?P<d>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])"
+_HMS = r"\s+(?P<H>2[0-3]|[0-1]\d|\d):(?P<MI>[0-5]\d|\d)"
+_SEC = r":(?P<S>6[0-1]|[0-5]\d|\d)"
+_DATETIME_PATTERNS = tuple(
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        f"{_Y}-{_M}-{_D}{_HMS}{_SEC}",
+        f"{_Y}-{_M}-{_D}{_HMS}",
+        f"{_D}-{_M}-{_Y}{_HMS}{_SEC}",
+        f"{_D}-{_M}-{_Y}{_HMS}",
+        f"{_Y}-{_M}-{_D}",
+        f"{_D}-{_M}-{_Y}",
+    )
+)
+_RELATIVE_DAYS = {"": 0, "0": 0, "hari ini": 0, "today": 0, "now": 0, "kemarin": 1, "yesterday": 1}
+
+@lru_cache(maxsize=1024)
+def _recognize_datetime(raw: str) -> int | str | None:
+    """Days back from now for relative words, a DB timestamp for dates, else None."""
+    days = _RELATIVE_DAYS.get(raw.lower())
+    if days is not None:
+        return days
+    s = raw.replace("/", "-").strip()
+    for pattern in _DATETIME_PATTERNS:
+        m = pattern.match(s)
+        if m is None or m.end() != len(s):
+            continue
+        g = m.groupdict()
+        y, mo, d = int(g["Y"]), int(g["m"]), int(g["d"])
+        sec = int(g.get("S") or 0)
+        if y < 1 or d > monthrange(y, mo)[1] or sec > 59:
+            continue
+        dt = datetime(y, mo, d, int(g.get("H") or 0), int(g.get("MI") or 0), sec, tzinfo=LOCAL_TZ)
+        return _format_db_dt(dt)
+    return None
 
-def _parse_amount(text: str) -> Decimal:
-    s = (text or "").strip()
-    # Keep digits and separators, strip any spaces including NBSP
-    filtered = "".join(ch for ch in s if ch.isdigit() or ch in ",.")
-    if not filtered:
-        raise ValueError("Nominal tidak valid")
-
-    has_comma = "," in filtered
-    has_dot = "." in filtered
-
-    if has_comma and has_dot:
-        # Decide decimal by the rightmost separator among comma/dot
-        last_comma = filtered.rfind(",")
-        last_dot = filtered.rfind(".")
-        if last_comma > last_dot:
-            # comma is decimal: drop all dots, replace last comma with dot
-            filtered = filtered.replace(".", "")
-            # replace ALL commas with dot, since previous commas could be decimals in OCR noise
-            filtered = filtered.replace(",", ".")
-        else:
-            # dot is decimal: drop all commas
-            filtered = filtered.replace(",", "")
-    elif has_comma and not has_dot:
-        # Only commas present. If multiple commas, treat last as decimal and others as thousands
-        if filtered.count(",") > 1:
-            last = filtered.rfind(",")
-            filtered = filtered[:last].replace(",", "") + "." + filtered[last+1:]
-        else:
-            filtered = filtered.replace(",", ".")
-    elif has_dot and not has_comma:
-        # Only dots present. Decide whether they are thousands separators or decimal.
-        parts = filtered.split(".")
-        if len(parts) == 1:
-            pass  # no-op
-        elif len(parts) == 2:
-            # One dot: if right side has length 3, treat as thousands (e.g., 20.000 -> 20000)
-            if len(parts[1]) == 3 and len(parts[0]) >= 1:
-                filtered = parts[0] + parts[1]
-            else:
-                # Treat as decimal (e.g., 20.5)
-                filtered = parts[0] + "." + parts[1]
-        else:
-            # Multiple dots
-            right_len = len(parts[-1])
-            left_ok = 1 <= len(parts[0]) <= 3
-            middle_ok = all(len(p) == 3 for p in parts[1:-1])
-            if right_len == 3 and left_ok and middle_ok:
-                # Pure thousands grouping: 1.234.567 -> 1234567
-                filtered = "".join(parts)
-            elif right_len in (1, 2):
-                # Likely decimal with thousands before: 1.234.56 or 1.234.5 -> 1234.56 / 1234.5
-                filtered = "".join(parts[:-1]) + "." + parts[-1]
-            else:
-                # Ambiguous; prefer treating as thousands: 12.3456.789 -> 123456789
-                filtered = "".join(parts)
-    # else: only digits
-
-    try:
-        return Decimal(filtered)
-    except InvalidOperation:
-        raise ValueError("Nominal tidak valid")
-
-def _first_sentence(text: str) -> str:
-    s = (text or "").strip()
-    for sep in [".", "!", "?", "\n"]:
-        idx = s.find(sep)
-        if idx != -1:
-            s = s[:idx]
-            break
-    return s.strip()
+def _try_datetime_input(text: str) -> str | None:
+    """Like _parse_datetime_input, but returns None instead of raising."""
+    value = _recognize_datetime((text or "").strip())
+    if isinstance(value, int):
+        now = datetime.now(LOCAL_TZ).replace(microsecond=0)
+        return _format_db_dt(now - timedelta(days=value) if value else now)
+    return value
 
 def _parse_datetime_input(text: str) -> str:
     """Parse user-provided date/time and return DB-friendly datetime with TZ offset.
@@ -284,335 +296,57 @@ def _parse_datetime_input(text: str) -> str:
     - Datetime: 'YYYY-MM-DD HH:MM[:SS]' or 'DD-MM-YYYY HH:MM[:SS]'
     - Also accepts '/' as separator in date part
     """
-    raw = (text or "").strip()
-    t = raw.lower()
-    if not t or t == "0" or t in {"hari ini", "today", "now"}:
-        return _now_iso()
-    if t in {"kemarin", "yesterday"}:
-        return _format_db_dt((datetime.now(LOCAL_TZ) - timedelta(days=1)).replace(microsecond=0))
+    value = _try_datetime_input(text)
+    if value is None:
+        raise ValueError("Format tanggal/waktu tidak dikenali. Contoh: 2025-10-30 14:30")
+    return value
 
-    s = raw.replace("/", "-").strip()
-    # Try datetime formats
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M"):
-        try:
-            dt = datetime.strptime(s, fmt).replace(microsecond=0)
-            # interpret as local time
-            dt = dt.replace(tzinfo=LOCAL_TZ)
-            return _format_db_dt(dt)
-        except Exception:
-            pass
-    # Try date-only formats
-    for fmt in ("%Y-%m-%d", "%d-%m-%Y"):
-        try:
-            d = datetime.strptime(s, fmt).date()
-            # default to 00:00:00 if time not provided
-            return _format_db_dt(datetime(d.year, d.month, d.day, 0, 0, 0, tzinfo=LOCAL_TZ))
-        except Exception:
-            pass
-    raise ValueError("Format tanggal/waktu tidak dikenali. Contoh: 2025-10-30 14:30")
+_TX_TYPES = {"income", "outcome"}
 
 def _try_parse_inline_full(text: str):
     """
-    Try parse: <desc> <income|outcome> <amount> <category> <bank>
-    Supports quotes around category/bank via shlex.
+    Try parse: <desc> <income|outcome> <amount> [date [time]] <category> <bank>
+    Supports quotes around category/bank (shlex rules).
     Returns dict or None if not matched.
     """
-    import shlex
     raw = (text or "").strip()
     if not raw:
         return None
-    try:
-        parts = shlex.split(raw)
-    except Exception:
-        return None
-    # find income/outcome token
-    type_idx = None
-    for i, p in enumerate(parts):
-        lp = p.lower()
-        if lp in {"income", "outcome"}:
-            type_idx = i
-            break
-    if type_idx is None:
-        return None
-    # need at least type, amount, category, bank (date between amount and category is optional)
-    if len(parts) < type_idx + 4:
+    parts = _split_words(raw)
+    if parts is None:
         return None
-    desc_tokens = parts[:type_idx]
-    if not desc_tokens:
+    type_idx = next((i for i, p in enumerate(parts) if p.lower() in _TX_TYPES), None)
+    # need desc, type, amount, category, bank (date between amount and category is optional)
+    if not type_idx or len(parts) < type_idx + 4:
         return None
-    tx_type = parts[type_idx].lower()
-    amount_token = parts[type_idx + 1]
-    # check optional date/datetime token (supports two tokens like 'YYYY-MM-DD HH:MM')
+    # optional date/datetime: two tokens ('YYYY-MM-DD HH:MM', 'hari ini') before one
     tx_at = None
     cat_idx = type_idx + 2
-    try:
-        # Try two-token datetime first
-        if cat_idx + 1 < len(parts):
-            probe2 = parts[cat_idx] + " " + parts[cat_idx + 1]
-            try:
-                tx_at = _parse_datetime_input(probe2)
-                cat_idx += 2
-            except Exception:
-                tx_at = None
-        # If two-token failed, try single token
-        if tx_at is None:
-            probe1 = parts[cat_idx]
-            tx_at = _parse_datetime_input(probe1)
-            cat_idx += 1
-    except Exception:
-        tx_at = None
-    category = parts[cat_idx]
-    bank = parts[cat_idx + 1] if len(parts) > cat_idx + 1 else None
-    if bank is None:
+    for width in (2, 1):
+        if cat_idx + width > len(parts):
+            continue
+        tx_at = _try_datetime_input(" ".join(parts[cat_idx:cat_idx + width]))
+        if tx_at is not None:
+            cat_idx += width
+            break
+    if cat_idx + 2 > len(parts):
+        return None
+    desc = " ".join(parts[:type_idx])
+    if len(desc.strip()) < 3:
         return None
-    # parse amount
     try:
-        amount = _parse_amount(amount_token)
+        amount = _parse_amount(parts[type_idx + 1])
     except Exception:
         return None
-    desc = " ".join(desc_tokens)
-    if len(desc.strip()) < 3:
-        return None
     return {
         "desc": _first_sentence(desc),
-        "type": tx_type,
+        "type": parts[type_idx].lower(),
         "amount": amount,
         "tx_at": tx_at,
-        "category": category,
-        "bank": bank,
+        "category": parts[cat_idx],
+        "bank": parts[cat_idx + 1],
     }
 
-def _ocr_image_to_text(image_path: str) -> str:
-    try:
-        img = Image.open(image_path)
-        # Preprocess: grayscale, autocontrast, increase contrast, sharpen, light threshold
-        g = ImageOps.grayscale(img)
-        g = ImageOps.autocontrast(g)
-        g = ImageEnhance.Contrast(g).enhance(1.5)
-        g = g.filter(ImageFilter.SHARPEN)
-        # upscale if small
-        try:
-            if min(g.size) < 1200:
-                scale = max(1.8, 1200 / float(min(g.size)))
-                g = g.resize((int(g.width * scale), int(g.height * scale)), Image.LANCZOS)
-        except Exception:
-            pass
-        try:
-            g_bin = g.point(lambda x: 255 if x > 180 else 0)
-        except Exception:
-            g_bin = g
-
-        texts: list[str] = []
-        for lang in ("eng", "eng+ind"):
-            for psm in (6, 4, 11):
-                config = f"--oem 3 --psm {psm} -c preserve_interword_spaces=1"
-                try:
-                    texts.append(pytesseract.image_to_string(g, lang=lang, config=config) or "")
-                    texts.append(pytesseract.image_to_string(g_bin, lang=lang, config=config) or "")
-                except Exception:
-                    continue
-        # return the longest non-empty result
-        best = max(texts, key=len) if texts else ""
-        return best
-    except Exception:
-        return ""
-
-def _pick_desc_from_text(text: str) -> str:
-    # choose the first non-trivial line
-    for line in (text or "").splitlines():
-        s = line.strip()
-        if len(s) >= 3 and not re.fullmatch(r"[0-9\s\-:./,]+", s):
-            return _first_sentence(s)
-    # fallback to first sentence of whole text
-    return _first_sentence(text)
-
-def _pick_amount_from_text(text: str) -> Decimal | None:
-    """Heuristics to pick amount from OCR text.
-    Priority:
-    1) Tokens near currency markers (IDR/Rp)
-    2) Tokens containing separators (comma/dot)
-    Avoid long integer strings (likely reference numbers).
-    """
-    t = text or ""
-    # 1) Contextual: after IDR/Rp
-    ctx_tokens = re.findall(r"(?:IDR|Rp)\s*([0-9][0-9.,\s\u00A0\u202F]{1,})", t, re.I)
-    for tok in ctx_tokens:
-        try:
-            return _parse_amount(tok)
-        except Exception:
-            continue
-    # 2) Any number that has thousand/decimal separators
-    tokens = re.findall(r"([0-9][0-9.,]{2,})", t)
-    best: Decimal | None = None
-    for tok in tokens:
-        # skip plain long integers (no separators)
-        if "," not in tok and "." not in tok:
-            continue
-        try:
-            val = _parse_amount(tok)
-        except Exception:
-            continue
-        if best is None or val > best:
-            best = val
-    return best
-
-def _ocr_amount_via_data(image_path: str) -> Decimal | None:
-    """Fallback: inspect word-level OCR to find amount near IDR/Rp tokens."""
-    try:
-        img = Image.open(image_path)
-        g = ImageOps.grayscale(img)
-        g = ImageOps.autocontrast(g)
-        g = ImageEnhance.Contrast(g).enhance(1.5)
-        try:
-            if min(g.size) < 1200:
-                scale = max(1.8, 1200 / float(min(g.size)))
-                g = g.resize((int(g.width * scale), int(g.height * scale)), Image.LANCZOS)
-        except Exception:
-            pass
-        data = pytesseract.image_to_data(g, lang="eng", config="--oem 3 --psm 6", output_type=Output.DICT)
-        words = data.get("text", [])
-
-        # 1) look for IDR/Rp then next few tokens
-        for i, w in enumerate(words):
-            if not w:
-                continue
-            t = w.strip()
-            if t.upper() in {"IDR", "RP"}:
-                buf = []
-                for j in range(1, 6):
-                    k = i + j
-                    if k >= len(words):
-                        break
-                    t2 = (words[k] or "").strip()
-                    if not t2:
-                        continue
-                    buf.append(t2)
-                candidate = " ".join(buf)
-                try:
-                    val = _parse_amount(candidate)
-                    return val
-                except Exception:
-                    continue
-
-        # 2) fallback: any numeric token with separators
-        best: Decimal | None = None
-        for w in words:
-            t = (w or "").strip()
-            if not t:
-                continue
-            if "," in t or "." in t:
-                try:
-                    v = _parse_amount(t)
-                except Exception:
-                    continue
-                if best is None or v > best:
-                    best = v
-        return best
-    except Exception:
-        return None
-
-def _normalize_ocr_amount(amount: Decimal) -> Decimal:
-    """For OCR sources, drop fractional part (e.g., 27,500.00 -> 27500)."""
-    try:
-        return amount.quantize(Decimal("1"), rounding=ROUND_DOWN)
-    except Exception:
-        return amount
-
-def _detect_bank_from_text(text: str) -> str | None:
-    t = (text or "").upper()
-    if "BCA" in t or "BANK CENTRAL ASIA" in t:
-        return "BCA"
-    return None
-
-def _parse_bca_receipt(text: str) -> dict:
-    """
-    Heuristics for BCA receipts/transfer slips. Returns partial fields.
-    Keys: desc, amount, bank
-    """
-    out: dict = {"bank": "BCA"}
-    lines = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
-
-    # amount candidates from lines containing typical BCA labels
-    amount_labels = [
-        "NOMINAL TUJUAN", "JUMLAH", "NOMINAL", "TOTAL", "JUMLAH TRANSFER",
-        "TOTAL BAYAR", "TOTAL TRANSAKSI", "TOTAL PEMBAYARAN"
-    ]
-    amount_val: Decimal | None = None
-    for ln in lines:
-        u = ln.upper()
-        if any(lbl in u for lbl in amount_labels) or "RP" in u or "IDR" in u:
-            m = re.search(r"(?:RP|IDR)?\s*([0-9][0-9.,]{2,})", ln, re.I)
-            if m:
-                try:
-                    amount_val = _parse_amount(m.group(1))
-                    break
-                except Exception:
-                    pass
-    if amount_val is None:
-        amount_val = _pick_amount_from_text(text)
-    if amount_val is not None:
-        out["amount"] = amount_val
-
-    # description: prefer BERITA/KETERANGAN block; else "Transfer ke <name>"; else first non-numeric line
-    desc: str | None = None
-    berita_seen = False
-    berita_has_content = False
-    # try BERITA section (can span multiple lines until next label)
-    for i, ln in enumerate(lines):
-        if re.search(r"^\s*BERITA\s*$", ln, re.I) or re.search(r"berita\s*[:\-]", ln, re.I):
-            collected: list[str] = []
-            # If line has content after separator, use that too
-            parts = re.split(r":|-", ln, maxsplit=1)
-            if len(parts) > 1 and parts[1].strip():
-                collected.append(parts[1].strip())
-            # collect following lines until next section header
-            for j in range(i + 1, len(lines)):
-                nxt = lines[j]
-                if re.search(r"^(?:NO\.?\s*REFERENSI|NOMOR\s*REFERENSI|REKENING\s*TUJUAN|JENIS\s*TRANSAKSI|MATA\s*UANG|DARI\s*REKENING|TRANSFER\s*BERHASIL)$", nxt, re.I):
-                    break
-                collected.append(nxt)
-            candidate = " ".join(s for s in collected if s).strip()
-            berita_seen = True
-            berita_has_content = len(candidate) >= 3
-            if len(candidate) >= 3:
-                desc = _first_sentence(candidate)
-            break
-    for ln in lines:
-        if desc:
-            break
-        if re.search(r"keterangan", ln, re.I):
-            # take after separator or the rest of line
-            part = re.split(r":|-", ln, maxsplit=1)
-            candidate = part[-1].strip() if len(part) > 1 else ln
-            if len(candidate) >= 3:
-                desc = _first_sentence(candidate)
-                break
-    if not desc and not (berita_seen and not berita_has_content):
-        # Transfer ke / Penerima
-        for idx, ln in enumerate(lines):
-            m = re.search(r"(transfer\s+ke|nama\s+penerima|penerima|kredit\s+ke)\s*[:\-]?\s*(.+)", ln, re.I)
-            if m:
-                candidate = m.group(2).strip()
-                # stop at obvious trailing tokens
-                candidate = re.split(r"\s{2,}|\s*Rp\s*", candidate)[0].strip()
-                if len(candidate) >= 3:
-                    desc = _first_sentence(f"Transfer ke {candidate}")
-                    break
-            # handle case label then next line is the value (like screenshot)
-            if re.fullmatch(r"nama\s+penerima", ln, re.I) and idx + 1 < len(lines):
-                candidate = lines[idx + 1].strip()
-                if len(candidate) >= 3:
-                    desc = _first_sentence(f"Transfer ke {candidate}")
-                    break
-    if not desc:
-        desc = _pick_desc_from_text(text)
-    if desc:
-        out["desc"] = desc
-    if berita_seen and not berita_has_content:
-        out["berita_empty"] = True
-
-    return out
-
 def _parse_menu_choice(text: str) -> str | None:
     """Return '0'..'4' if text is a menu choice even with minor punctuation/space.
     '0' means cancel.
@@ -626,32 +360,93 @@ def _parse_menu_choice(text: str) -> str | None:
         return m.group(1)
     return None
 
+LIST_PAGE_SIZE = 10
+
+async def _list_filters(args: dict) -> dict:
+    """Filters for /list from key=value args; raises ValueError with a user-facing message."""
+    out: dict = {}
+    tx_type = (args.get("type") or "").lower()
+    if tx_type:
+        if tx_type not in {"income", "outcome"}:
+            raise ValueError("type harus income atau outcome.")
+        out["tx_type"] = tx_type
+    for key, table, label in (("bank", "bank", "Bank"), ("category", "category", "Kategori")):
+        name = args.get(key)
+        if name:
+            found = await taxonomy.lookup_id(table, name)
+            if not found:
+                raise ValueError(f"{label} '{name}' tidak ditemukan.")
+            out[f"{key}_id"] = found
+    start, end, _ = _parse_period(args)
+    if start:
+        out["start"] = start
+    if end:
+        out["end"] = end
+    return out
+
+@metrics.timed
 async def list_tx(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/list [next|prev] [type=..] [bank=..] [category=..] [month=.. | from=.. to=..]"""
     try:
+        text = update.message.text or ""
+        words = [w.lower() for w in text.split()[1:]]
+        action = "next" if "next" in words else "prev" if "prev" in words else None
+        state = context.user_data.get("list_state") if action else None
+        if state is None:
+            try:
+                filters_ = await _list_filters(parse_kv_args(text))
+            except ValueError as e:
+                await update.message.reply_text(
+                    f"{e}\nContoh: /list type=outcome bank=BCA month=2025-10"
+                )
+                return
+            # pages[i] is the keyset cursor the i-th page starts after
+            state = {"filters": filters_, "pages": [None], "next": None}
+        elif action == "next":
+            if not state.get("next"):
+                await update.message.reply_text("Tidak ada halaman berikutnya.")
+                return
+            state["pages"].append(state["next"])
+        elif len(state["pages"]) > 1:
+            state["pages"].pop()
+
         user_id = await get_or_create_app_user_id(update)
-        # join via dot notation
-        sel = (
-            'id, type, description, transaction_date, '
-            'bank:bank_id(name), category:category_id(name)'
+        rows = await db.list_transactions(
+            user_id, limit=LIST_PAGE_SIZE + 1, before=state["pages"][-1], **state["filters"]
         )
-        res = sb.table("transaction") \
-                .select(sel) \
-                .eq("user_id", user_id) \
-                .order("transaction_date", desc=True) \
-                .limit(10).execute()
-
-        if not res.data:
-            await update.message.reply_text("Belum ada transaksi.")
+        has_next = len(rows) > LIST_PAGE_SIZE
+        rows = rows[:LIST_PAGE_SIZE]
+        state["next"] = (rows[-1]["transaction_date"], rows[-1]["id"]) if has_next else None
+        context.user_data["list_state"] = state
+
+        if not rows:
+            await update.message.reply_text(
+                "Tidak ada transaksi yang cocok." if state["filters"] else "Belum ada transaksi."
+            )
             await _show_menu(update)
             return
 
-        lines = ["📜 10 transaksi terakhir:"]
-        for r in res.data:
+        bank_names = await taxonomy.names_by_id("bank", {r.get("bank_id") for r in rows})
+        cat_names = await taxonomy.names_by_id("category", {r.get("category_id") for r in rows})
+        page = len(state["pages"])
+        if page == 1 and not state["filters"]:
+            lines = [f"📜 {LIST_PAGE_SIZE} transaksi terakhir:"]
+        else:
+            lines = [f"📜 Transaksi (hal. {page}):"]
+        for r in rows:
             ts = _format_dt_for_display(r.get('transaction_date'))
             lines.append(
                 f"• {ts} [{r['type']}] "
-                f"{r.get('description') or '-'} — {r['category']['name']} @ {r['bank']['name']}"
+                f"{r.get('description') or '-'} — "
+                f"{cat_names.get(r.get('category_id'), '-')} @ {bank_names.get(r.get('bank_id'), '-')}"
             )
+        nav = []
+        if page > 1:
+            nav.append("⬅️ /list prev")
+        if has_next:
+            nav.append("➡️ /list next")
+        if nav:
+            lines += ["", "  ".join(nav)]
         await update.message.reply_text("\n".join(lines))
         await _show_menu(update)
 
@@ -661,27 +456,57 @@ async def list_tx(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await _show_menu(update)
 
 # ---------- Summary ----------
-async def show_summary(update: Update):
+def _parse_period(args: dict) -> tuple[str | None, str | None, str]:
+    """Period from command args: month=YYYY-MM, or from=<date> and/or to=<date>.
+    Returns (start, end_exclusive, label); (None, None, "") means all time.
+    A date-only 'to' includes that whole day.
+    """
+    month = (args.get("month") or "").strip()
+    if month:
+        m = re.fullmatch(r"(\d{4})-(\d{1,2})", month)
+        if not m or not 1 <= int(m.group(2)) <= 12:
+            raise ValueError("Format bulan: YYYY-MM, contoh month=2025-10")
+        y, mo = int(m.group(1)), int(m.group(2))
+        start = datetime(y, mo, 1, tzinfo=LOCAL_TZ)
+        end = datetime(y + mo // 12, mo % 12 + 1, 1, tzinfo=LOCAL_TZ)
+        return _format_db_dt(start), _format_db_dt(end), f"{y:04d}-{mo:02d}"
+    raw_from = (args.get("from") or "").strip()
+    raw_to = (args.get("to") or "").strip()
+    if not raw_from and not raw_to:
+        return None, None, ""
+    start = _parse_datetime_input(raw_from) if raw_from else None
+    end = None
+    if raw_to:
+        end = _parse_datetime_input(raw_to)
+        if not re.search(r"\d{1,2}:\d{2}", raw_to):
+            end = _format_db_dt(datetime.fromisoformat(end) + timedelta(days=1))
+    return start, end, f"{raw_from or '…'} s/d {raw_to or '…'}"
+
+@metrics.timed
+async def show_summary(update: Update, context: ContextTypes.DEFAULT_TYPE | None = None):
     try:
-        # Note: show_summary is called via command, not conversation handler
-        # We derive user via update
+        # Called via /summary (with optional period args) or menu choice 3 (all time)
+        args = parse_kv_args(update.message.text or "")
+        try:
+            start, end, label = _parse_period(args)
+        except ValueError:
+            return await update.message.reply_text(
+                "Periode tidak valid.\nContoh:\n/summary month=2025-10\n/summary from=2025-10-01 to=2025-10-15"
+            )
         user_id = await get_or_create_app_user_id(update)
-        res = sb.table("transaction").select("type, amount").eq("user_id", user_id).execute()
-        income = Decimal("0")
-        outcome = Decimal("0")
-        for r in (res.data or []):
-            amt = r.get("amount")
-            try:
-                val = Decimal(str(amt)) if amt is not None else Decimal("0")
-            except Exception:
-                val = Decimal("0")
-            if r.get("type") == "income":
-                income += val
-            elif r.get("type") == "outcome":
-                outcome += val
-        saldo = income - outcome
+        if start is None and end is None:
+            # running totals kept by trigger: one primary-key lookup
+            totals = await db.user_balance(user_id)
+        elif args.get("month"):
+            totals = await db.user_balance_month(user_id, start[:10])
+        else:
+            totals = await db.transaction_summary(user_id, start, end)
+        income = Decimal(str(totals.get("income") or 0))
+        outcome = Decimal(str(totals.get("outcome") or 0))
+        saldo = Decimal(str(totals.get("balance") or 0))
+        header = f"📊 Ringkasan {label}:\n" if label else "📊 Ringkasan:\n"
         msg = (
-            "📊 Ringkasan:\n"
+            header +
             f"• Total income: <span class=\"tg-spoiler\">{_format_rp(income)}</span>\n"
             f"• Total outcome: <span class=\"tg-spoiler\">{_format_rp(outcome)}</span>\n"
             f"• Saldo: <span class=\"tg-spoiler\">{_format_rp(saldo)}</span>"
@@ -693,6 +518,349 @@ async def show_summary(update: Update):
         await update.message.reply_text(f"❌ Gagal menghitung ringkasan: {e}")
         await _show_menu(update)
 
+@metrics.timed
+async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/report [month=YYYY-MM | from=<date> to=<date>]: totals per category and per bank."""
+    try:
+        args = parse_kv_args(update.message.text or "")
+        if not any(k in args for k in ("month", "from", "to")):
+            args["month"] = datetime.now(LOCAL_TZ).strftime("%Y-%m")
+        try:
+            start, end, label = _parse_period(args)
+        except ValueError:
+            return await update.message.reply_text(
+                "Periode tidak valid.\nContoh:\n/report month=2025-10\n/report from=2025-10-01 to=2025-10-15"
+            )
+        user_id = await get_or_create_app_user_id(update)
+        key = (user_id, await db.user_balance_version(user_id), start, end)
+        rows = _report_cache.get(key)
+        if rows is None:
+            rows = await db.transaction_report(user_id, start, end)
+            _report_cache.set(key, rows)
+        if not rows:
+            await update.message.reply_text(f"Belum ada transaksi untuk {label}.")
+            return
+        lines = [f"📈 Laporan {label}"]
+        for dimension, title in (("category", "Per kategori:"), ("bank", "Per bank:")):
+            lines += ["", title]
+            for r in rows:
+                if r.get("dimension") != dimension:
+                    continue
+                lines.append(
+                    f"• {r.get('name')}: outcome {_format_rp(r.get('outcome'))}, "
+                    f"income {_format_rp(r.get('income'))} ({r.get('tx_count')}x)"
+                )
+        await update.message.reply_text("\n".join(lines))
+    except Exception as e:
+        logging.exception("report failed")
+        await update.message.reply_text(f"❌ Gagal membuat laporan: {e}")
+
+@metrics.timed
+async def reconcile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Rebuild this user's running totals from their transactions and report drift."""
+    try:
+        user_id = await get_or_create_app_user_id(update)
+        drift = await db.reconcile_balances(user_id)
+        if not drift:
+            await update.message.reply_text("✅ Saldo sudah sesuai dengan transaksi.")
+            return
+        lines = [f"⚠️ Ditemukan selisih di {len(drift)} bulan (sudah diperbaiki):"]
+        for r in drift:
+            lines.append(
+                f"• {str(r.get('month'))[:7]}: income {_format_rp(r.get('income_drift'))}, "
+                f"outcome {_format_rp(r.get('outcome_drift'))}"
+            )
+        await update.message.reply_text("\n".join(lines))
+    except Exception as e:
+        logging.exception("reconcile failed")
+        await update.message.reply_text(f"❌ Gagal rekonsiliasi saldo: {e}")
+
+# ---------- Import ----------
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+# accepted header names per field (generic CSV)
+_IMPORT_COLUMNS = {
+    "date": {"date", "tanggal", "transaction_date", "waktu"},
+    "desc": {"desc", "description", "deskripsi", "keterangan"},
+    "type": {"type", "tipe", "jenis"},
+    "amount": {"amount", "nominal", "jumlah"},
+    "category": {"category", "kategori"},
+    "bank": {"bank"},
+}
+_IMPORT_TYPES = {
+    "income": "income", "in": "income", "cr": "income", "kredit": "income", "credit": "income",
+    "outcome": "outcome", "out": "outcome", "db": "outcome", "debit": "outcome", "debet": "outcome",
+}
+
+def _bca_statement_period(preamble: list[list[str]]) -> tuple[int, int, int]:
+    """(start year, end year, end month) of a KlikBCA statement's 'Periode : dd/mm/yyyy - dd/mm/yyyy' line.
+
+    Without that line the period is taken to end this month.
+    """
+    for row in preamble:
+        m = re.findall(r"\d{2}/(\d{2})/(\d{4})", " ".join(row))
+        if m:
+            (_, start_year), (end_month, end_year) = m[0], m[-1]
+            return int(start_year), int(end_year), int(end_month)
+    today = datetime.now(LOCAL_TZ)
+    return today.year - 1, today.year, today.month
+
+
+def _bca_row_year(month: int, period: tuple[int, int, int]) -> int:
+    """Year of a 'dd/mm' statement row: months after the period's end month belong to its start year."""
+    start_year, end_year, end_month = period
+    return start_year if month > end_month else end_year
+
+def _iter_import_rows(data: bytes, defaults: dict):
+    """Yield (line_no, fields | None, error | None) for each data row of an import file.
+
+    Understands a generic CSV with a header row (see _IMPORT_COLUMNS) and the
+    KlikBCA e-statement CSV (Tanggal Transaksi, Keterangan, Cabang, Jumlah, DB/CR, Saldo).
+    ``defaults`` (bank/category/type from the caption) fill missing columns.
+    """
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline="")
+    sample = data[:4096].decode("utf-8", errors="replace")
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(text, dialect)
+    columns: dict[str, int] | None = None
+    bca_period: tuple[int, int, int] | None = None
+    preamble: list[list[str]] = []
+    for row in reader:
+        line_no = reader.line_num
+        cells = [c.strip().strip("'") for c in row]
+        if not any(cells):
+            continue
+        if columns is None and bca_period is None:
+            head = [c.lower() for c in cells]
+            if head[0].startswith("tanggal transaksi"):
+                bca_period = _bca_statement_period(preamble)
+                continue
+            found = {f: i for i, h in enumerate(head) for f, names in _IMPORT_COLUMNS.items() if h in names}
+            if "amount" in found and "date" in found:
+                columns = found
+                continue
+            preamble.append(cells)
+            continue
+        try:
+            if bca_period is not None:
+                # 'dd/mm' rows; anything else is the statement footer or a pending row
+                m = re.fullmatch(r"(\d{2})/(\d{2})", cells[0])
+                if not m:
+                    continue
+                amount_cell = cells[3] if len(cells) > 3 else ""
+                flag = (cells[4] if len(cells) > 4 else "").upper()
+                if not flag:
+                    parts = amount_cell.split()
+                    flag = parts[-1].upper() if len(parts) > 1 else ""
+                    amount_cell = parts[0] if parts else ""
+                fields = {
+                    "date": f"{m.group(1)}-{m.group(2)}-{_bca_row_year(int(m.group(2)), bca_period)}",
+                    "desc": cells[1] if len(cells) > 1 else "",
+                    "type": flag,
+                    "amount": amount_cell,
+                    "bank": "BCA",
+                }
+            else:
+                fields = {f: (cells[i] if i < len(cells) else "") for f, i in columns.items()}
+            tx_type = _IMPORT_TYPES.get((fields.get("type") or defaults.get("type") or "").strip().lower())
+            if tx_type is None and (fields.get("amount") or "").lstrip().startswith("-"):
+                tx_type = "outcome"
+            if tx_type is None:
+                raise ValueError("tipe tidak dikenali")
+            if not (fields.get("date") or "").strip():
+                raise ValueError("tanggal kosong")
+            bank = (fields.get("bank") or defaults.get("bank") or "").strip()
+            category = (fields.get("category") or defaults.get("category") or "").strip()
+            if not bank or not category:
+                raise ValueError("bank/kategori kosong")
+            yield line_no, {
+                "date": _parse_datetime_input(fields["date"]),
+                "desc": " ".join((fields.get("desc") or "").split())[:200] or None,
+                "type": tx_type,
+                "amount": _parse_amount(fields.get("amount") or ""),
+                "bank": bank,
+                "category": category,
+            }, None
+        except (ValueError, IndexError) as e:
+            yield line_no, None, str(e)
+    if columns is None and bca_period is None:
+        yield 0, None, "header tidak dikenali (butuh kolom tanggal dan nominal)"
+
+@metrics.timed
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """CSV / KlikBCA e-statement upload: batched import into ``transaction``.
+
+    Caption may set defaults, e.g. ``category=Lainnya bank=BCA type=outcome``.
+    """
+    doc = update.message.document
+    if not (doc.file_name or "").lower().endswith(".csv"):
+        await update.message.reply_text("Untuk impor, kirim file .csv (ekspor mutasi BCA atau CSV dengan header).")
+        return
+    if (doc.file_size or 0) > IMPORT_MAX_BYTES:
+        await update.message.reply_text("File terlalu besar untuk diimpor.")
+        return
+    progress = await update.message.reply_text("📥 Membaca file…")
+    try:
+        f = await doc.get_file()
+        data = bytes(await f.download_as_bytearray())
+        defaults = parse_kv_args("/import " + (update.message.caption or ""))
+        defaults.setdefault("category", "Lainnya")
+
+        # pass 1: validate and collect the distinct taxonomy names
+        banks: set[str] = set()
+        categories: set[str] = set()
+        total = 0
+        rejected: list[tuple[int, str]] = []
+        for line_no, row, err in _iter_import_rows(data, defaults):
+            if row is None:
+                rejected.append((line_no, err))
+                continue
+            total += 1
+            banks.add(row["bank"])
+            categories.add(row["category"])
+        if not total:
+            await progress.edit_text("❌ Tidak ada baris yang bisa diimpor.")
+        else:
+            user_id = await get_or_create_app_user_id(update)
+            bank_ids = await taxonomy.resolve_ids("bank", banks)
+            category_ids = await taxonomy.resolve_ids("category", categories)
+
+            # pass 2: stream rows into multi-row inserts
+            done = 0
+            batch: list[dict] = []
+            for _, row, _ in _iter_import_rows(data, defaults):
+                if row is None:
+                    continue
+                batch.append({
+                    "bank_id": bank_ids[row["bank"]],
+                    "category_id": category_ids[row["category"]],
+                    "type": row["type"],
+                    "amount": float(row["amount"]),
+                    "description": row["desc"],
+                    "transaction_date": row["date"],
+                    "user_id": user_id,
+                })
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await db.insert_transactions(batch)
+                    done += len(batch)
+                    batch = []
+                    await progress.edit_text(f"📥 Mengimpor… {done}/{total}")
+            await db.insert_transactions(batch)
+            done += len(batch)
+            await progress.edit_text(f"✅ Impor selesai: {done} transaksi.")
+
+        if rejected:
+            lines = [f"⚠️ {len(rejected)} baris dilewati:"]
+            for line_no, err in rejected[:10]:
+                lines.append(f"• baris {line_no}: {err}" if line_no else f"• {err}")
+            if len(rejected) > 10:
+                lines.append(f"… dan {len(rejected) - 10} lainnya")
+            await update.message.reply_text("\n".join(lines))
+    except Exception as e:
+        logging.exception("import failed")
+        await update.message.reply_text(f"❌ Gagal mengimpor: {e}")
+
+# ---------- Export ----------
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+_EXPORT_HEADER = ["date", "type", "amount", "description", "category", "bank", "id"]
+
+def _export_dt(value: str | None) -> str:
+    """DB timestamp as local 'YYYY-MM-DD HH:MM:SS+07:00'."""
+    try:
+        return _format_db_dt(datetime.fromisoformat(str(value).replace("Z", "+00:00")))
+    except Exception:
+        return str(value or "")
+
+async def _iter_export_rows(user_id: str, start: str | None, end: str | None):
+    """All of a user's transactions as export rows, one keyset page in memory at a time."""
+    cursor = None
+    while True:
+        page = await db.list_transactions(
+            user_id, limit=EXPORT_PAGE_SIZE, before=cursor, start=start, end=end
+        )
+        if not page:
+            return
+        bank_names = await taxonomy.names_by_id("bank", {r.get("bank_id") for r in page})
+        cat_names = await taxonomy.names_by_id("category", {r.get("category_id") for r in page})
+        for r in page:
+            amount = r.get("amount")
+            yield [
+                _export_dt(r.get("transaction_date")),
+                r.get("type"),
+                Decimal(str(amount)) if amount is not None else None,
+                r.get("description") or "",
+                cat_names.get(r.get("category_id"), ""),
+                bank_names.get(r.get("bank_id"), ""),
+                r.get("id"),
+            ]
+        # a short page is not the end: PostgREST caps pages at its max_rows,
+        # which may be below EXPORT_PAGE_SIZE; only an empty page is
+        cursor = (page[-1]["transaction_date"], page[-1]["id"])
+
+
+async def _write_export(out, fmt: str, user_id: str, start: str | None = None, end: str | None = None) -> int:
+    """Stream a user's history into the binary file ``out`` as gzip CSV or XLSX; returns row count."""
+    n = 0
+    if fmt == "xlsx":
+        # optional heavy import, only needed for this path
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("transaksi")
+        ws.append(_EXPORT_HEADER)
+        async for row in _iter_export_rows(user_id, start, end):
+            ws.append(row)
+            n += 1
+        wb.save(out)
+        return n
+    with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+        text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        w = csv.writer(text)
+        w.writerow(_EXPORT_HEADER)
+        async for row in _iter_export_rows(user_id, start, end):
+            w.writerow(row)
+            n += 1
+        text.flush()
+        text.detach()
+    return n
+
+@metrics.timed
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [xlsx] [month=YYYY-MM | from=<date> to=<date>]: full history as a file."""
+    try:
+        text = update.message.text or ""
+        args = parse_kv_args(text)
+        words = [w.lower() for w in text.split()[1:]]
+        fmt = "xlsx" if "xlsx" in words or args.get("format", "").lower() == "xlsx" else "csv"
+        try:
+            start, end, label = _parse_period(args)
+        except ValueError:
+            return await update.message.reply_text(
+                "Periode tidak valid.\nContoh:\n/export month=2025-10\n/export xlsx from=2025-01-01 to=2025-06-30"
+            )
+        user_id = await get_or_create_app_user_id(update)
+        status = await update.message.reply_text("📤 Menyiapkan ekspor…")
+        # spooled to an anonymous temp file (removed on close), never held in memory
+        with tempfile.TemporaryFile() as out:
+            n = await _write_export(out, fmt, user_id, start, end)
+            if not n:
+                await status.edit_text("Belum ada transaksi untuk diekspor.")
+                return
+            out.seek(0)
+            stamp = datetime.now(LOCAL_TZ).strftime("%Y%m%d")
+            filename = f"cashflow-{stamp}.xlsx" if fmt == "xlsx" else f"cashflow-{stamp}.csv.gz"
+            await update.message.reply_document(
+                document=out, filename=filename,
+                caption=f"{n} transaksi" + (f" ({label})" if label else ""),
+            )
+        await status.edit_text("✅ Ekspor selesai.")
+    except Exception as e:
+        logging.exception("export failed")
+        await update.message.reply_text(f"❌ Gagal mengekspor: {e}")
+
 # ---------- Bootstrap ----------
 # Conversational free-text flow (no command, numeric choices)
 DESC, AMOUNT, TXDATE, TYPE, BANK, CATEGORY = range(6)
@@ -718,6 +886,7 @@ async def _show_menu(update: Update):
         "4) Batal"
     )
 
+@metrics.timed
 async def free_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (update.message.text or "").strip()
     if not text:
@@ -746,7 +915,7 @@ async def free_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_id = await get_or_create_app_user_id(update)
             bank_id = await get_or_create_id("bank", parsed["bank"], None)
             category_id = await get_or_create_id("category", parsed["category"], None)
-            sb.table("transaction").insert({
+            await _save_transaction({
                 "bank_id": bank_id,
                 "category_id": category_id,
                 "type": parsed["type"],
@@ -754,7 +923,7 @@ async def free_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "description": parsed["desc"],
                 "transaction_date": parsed.get("tx_at") or _now_iso(),
                 "user_id": user_id,
-            }).execute()
+            })
             ts = _format_dt_for_display(parsed.get("tx_at") or _now_iso())
             await update.message.reply_text(
                 f"✅ Tersimpan { _format_rp(parsed['amount']) }: [{parsed['type']}] "
@@ -784,6 +953,7 @@ async def free_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Nominal? (contoh: 12.500)")
     return AMOUNT
 
+@metrics.timed
 async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Skip OCR on environments without Tesseract (e.g., Vercel)
     if os.getenv("DISABLE_OCR", "").lower() in {"1", "true", "yes"}:
@@ -792,26 +962,53 @@ async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await _show_menu(update)
         return ConversationHandler.END
+    # PIL/pytesseract are only loaded once a photo actually arrives
+    import ocr
+    user_key = int(getattr(update.effective_user, "id", 0))
+    status_msg = None
     # Download the highest resolution photo
     try:
-        status_msg = await update.message.reply_text("🔎 Membaca gambar…")
         photo = update.message.photo[-1]
-        f = await photo.get_file()
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-            tmp_path = tmp.name
-        await f.download_to_drive(custom_path=tmp_path)
-        await status_msg.edit_text("🧠 Memproses OCR…")
-        text = _ocr_image_to_text(tmp_path)
-        # bank-specific parsing (BCA) if detected
-        bank_hint = _detect_bank_from_text(text)
-        desc = None
-        amount = None
-        if bank_hint == "BCA":
-            parsed = _parse_bca_receipt(text)
-            desc = parsed.get("desc")
-            amount = parsed.get("amount")
-            context.user_data["bank"] = parsed.get("bank") or "BCA"
-            if parsed.get("berita_empty") and not desc:
+        if (photo.file_size or 0) > ocr.OCR_MAX_BYTES:
+            await update.message.reply_text(
+                "Gambar terlalu besar untuk dibaca. Kirim foto yang lebih kecil atau input manual."
+            )
+            await _show_menu(update)
+            return ConversationHandler.END
+        status_msg = await update.message.reply_text("🔎 Membaca gambar…")
+        # forwarded/retried photos: reuse the parsed result without downloading
+        ocr_res = await ocr.result_cache().get(photo.file_unique_id)
+        if ocr_res is None:
+            started = time.perf_counter()
+            f = await photo.get_file()
+            # keep the photo in memory; nothing is written to disk
+            data = bytes(await f.download_as_bytearray())
+            metrics.observe_ocr("download", time.perf_counter() - started)
+            if len(data) > ocr.OCR_MAX_BYTES:
+                raise ValueError(f"photo too large: {len(data)} bytes")
+            digest = ocr.content_hash(data)
+            ocr_res = await ocr.result_cache().get(digest)
+            if ocr_res is None:
+                await status_msg.edit_text("🧠 Memproses OCR…")
+                # one OCR pass set per image; text, word boxes and parsed fields come back together
+                ocr_res = await ocr.run(user_key, ocr.read_receipt, data)
+                for stage, seconds in ocr_res.timings:
+                    metrics.observe_ocr(stage, seconds)
+            if ocr_res.text:
+                await ocr.result_cache().put([photo.file_unique_id, digest], ocr_res)
+        text = ocr_res.text
+        logging.info(
+            "ocr passes=%d pixels=%d conf=%.1f accepted=%s",
+            ocr_res.passes, ocr_res.pixels, ocr_res.confidence, ocr_res.accepted,
+        )
+        bank_hint = ocr_res.bank_hint
+        desc = ocr_res.desc
+        amount = ocr_res.amount
+        if bank_hint:
+            account = receipts.account_name(bank_hint)
+            if account:
+                context.user_data["bank"] = account
+            if ocr_res.berita_empty:
                 # explicitly ask for manual description if BERITA exists but empty
                 if amount is not None:
                     context.user_data["amount"] = _normalize_ocr_amount(amount)
@@ -819,12 +1016,6 @@ async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "Bagian 'Berita' kosong. Tulis deskripsi transaksi:"
                 )
                 return DESC
-        if not desc:
-            desc = _pick_desc_from_text(text)
-        if amount is None:
-            amount = _pick_amount_from_text(text)
-        if amount is None:
-            amount = _ocr_amount_via_data(tmp_path)
         if amount is not None:
             amount = _normalize_ocr_amount(amount)
 
@@ -841,7 +1032,8 @@ async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if DEBUG_OCR:
                 snippet = (text or "").strip().replace("\n\n", "\n")
                 await update.message.reply_text(
-                    "[Debug OCR]\n" + (snippet[:1000] + ("…" if len(snippet) > 1000 else ""))
+                    f"[Debug OCR] passes={ocr_res.passes} conf={ocr_res.confidence:.0f}\n"
+                    + (snippet[:1000] + ("…" if len(snippet) > 1000 else ""))
                 )
             await status_msg.edit_text("ℹ️ Nominal belum terbaca. Mohon ketik nominal.")
             return AMOUNT
@@ -852,25 +1044,21 @@ async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await status_msg.edit_text("ℹ️ Deskripsi belum terbaca. Mohon ketik deskripsi.")
             return DESC
 
-        # For BCA receipts, default to outcome and skip type step
-        if bank_hint == "BCA":
+        # For recognized bank/wallet receipts, default to outcome and skip type step
+        if bank_hint:
             context.user_data["type"] = "outcome"
             await status_msg.edit_text("✅ OCR selesai.")
             # proceed to bank selection
-            banks = sb.table("bank").select("name").order("name").execute().data or []
-            names = [b["name"] for b in banks]
-            context.user_data["bank_options"] = names
+            snap = await taxonomy.snapshot("bank")
+            context.user_data["bank_options"] = list(snap.names)
             header = (
                 f"Terbaca: { _format_rp(context.user_data['amount']) } — {context.user_data['desc']}\n"
                 f"Tipe: outcome"
             )
             if context.user_data.get("bank"):
                 header += f"\nBank: {context.user_data['bank']} (bisa ubah)"
-            if names:
-                lines = [header, "", "Pilih bank:"]
-                for i, n in enumerate(names, 1):
-                    lines.append(f"{i}) {n}")
-                await update.message.reply_text("\n".join(lines))
+            if snap.names:
+                await update.message.reply_text("\n".join([header, "", "Pilih bank:", snap.menu]))
             else:
                 await update.message.reply_text(header + "\nBelum ada bank. Ketik nama bank baru:")
             return BANK
@@ -882,6 +1070,15 @@ async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await status_msg.edit_text("✅ OCR selesai.")
         return TYPE
+    except ocr.OcrBusy:
+        logging.info("ocr busy: %s", ocr.stats())
+        await update.message.reply_text(
+            "⏳ Server sedang sibuk memproses gambar lain. Coba kirim lagi sebentar lagi, atau input manual."
+        )
+        if status_msg is not None:
+            await status_msg.edit_text("⏳ OCR sibuk.")
+        await _show_menu(update)
+        return ConversationHandler.END
     except Exception as e:
         logging.exception("ocr failed")
         await update.message.reply_text(
@@ -894,6 +1091,7 @@ async def ocr_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await _show_menu(update)
         return ConversationHandler.END
 
+@metrics.timed
 async def free_desc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if (update.message.text or "").strip() == "0":
         await free_cancel(update, context)
@@ -906,6 +1104,7 @@ async def free_desc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Nominal? (contoh: 12.500)")
     return AMOUNT
 
+@metrics.timed
 async def free_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if (update.message.text or "").strip() == "0":
         await free_cancel(update, context)
@@ -922,6 +1121,7 @@ async def free_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return TXDATE
 
+@metrics.timed
 async def free_txdate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if (update.message.text or "").strip() == "0":
         context.user_data["tx_at"] = _now_iso()
@@ -938,6 +1138,7 @@ async def free_txdate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Tipe? 1) income  2) outcome")
     return TYPE
 
+@metrics.timed
 async def free_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     t = (update.message.text or "").strip().lower()
     if t == "0":
@@ -952,18 +1153,17 @@ async def free_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return TYPE
     context.user_data["type"] = t
     # list banks (shared)
-    banks = sb.table("bank").select("name").order("name").execute().data or []
-    names = [b["name"] for b in banks]
-    context.user_data["bank_options"] = names
-    if names:
-        lines = ["Pilih bank (ketik angka atau tulis nama bank baru):"]
-        for i, n in enumerate(names, 1):
-            lines.append(f"{i}) {n}")
-        await update.message.reply_text("\n".join(lines))
+    snap = await taxonomy.snapshot("bank")
+    context.user_data["bank_options"] = list(snap.names)
+    if snap.names:
+        await update.message.reply_text(
+            "Pilih bank (ketik angka atau tulis nama bank baru):\n" + snap.menu
+        )
     else:
         await update.message.reply_text("Belum ada bank. Ketik nama bank baru:")
     return BANK
 
+@metrics.timed
 async def free_bank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (update.message.text or "").strip()
     options = context.user_data.get("bank_options", [])
@@ -982,18 +1182,17 @@ async def free_bank(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chosen = text
     context.user_data["bank"] = chosen
     # list categories (shared)
-    cats = sb.table("category").select("name").order("name").execute().data or []
-    names = [c["name"] for c in cats]
-    context.user_data["cat_options"] = names
-    if names:
-        lines = ["Pilih kategori (ketik angka atau tulis nama kategori baru):"]
-        for i, n in enumerate(names, 1):
-            lines.append(f"{i}) {n}")
-        await update.message.reply_text("\n".join(lines))
+    snap = await taxonomy.snapshot("category")
+    context.user_data["cat_options"] = list(snap.names)
+    if snap.names:
+        await update.message.reply_text(
+            "Pilih kategori (ketik angka atau tulis nama kategori baru):\n" + snap.menu
+        )
     else:
         await update.message.reply_text("Belum ada kategori. Ketik nama kategori baru:")
     return CATEGORY
 
+@metrics.timed
 async def free_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         text = (update.message.text or "").strip()
@@ -1021,7 +1220,7 @@ async def free_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         bank_id = await get_or_create_id("bank", bank, None)
         category_id = await get_or_create_id("category", chosen, None)
 
-        sb.table("transaction").insert({
+        await _save_transaction({
             "bank_id": bank_id,
             "category_id": category_id,
             "type": tx_type,
@@ -1029,7 +1228,7 @@ async def free_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "description": desc or None,
             "transaction_date": context.user_data.get("tx_at") or _now_iso(),
             "user_id": user_id,
-        }).execute()
+        })
 
         ts = _format_dt_for_display(context.user_data.get("tx_at") or _now_iso())
         await update.message.reply_text(
@@ -1043,14 +1242,34 @@ async def free_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.clear()
     return ConversationHandler.END
 
+@metrics.timed
 async def free_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     await update.message.reply_text("Dibatalkan.")
     await _show_menu(update)
     return ConversationHandler.END
 
+async def _post_init(_app) -> None:
+    if spool.WRITE_BEHIND:
+        spool.start()
+
+async def _post_shutdown(_app) -> None:
+    if spool.WRITE_BEHIND:
+        await spool.stop()
+
 def main():
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    state = persistence.build()
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+    )
+    if state is not None:
+        builder = builder.persistence(state)
+    if (request := metrics.bot_request()) is not None:
+        builder = builder.request(request)
+    app = builder.build()
 
     # Conversation for free-text inputs (non-command messages)
     conv = ConversationHandler(
@@ -1067,12 +1286,21 @@ def main():
             CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, free_category)],
         },
         fallbacks=[CommandHandler("cancel", free_cancel)],
+        name="free_entry",
+        persistent=state is not None,
     )
 
     app.add_handler(conv)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("add", add))
     app.add_handler(CommandHandler("list", list_tx))
+    app.add_handler(CommandHandler("summary", show_summary))
+    app.add_handler(CommandHandler("report", report))
+    app.add_handler(CommandHandler("reconcile", reconcile))
+    app.add_handler(CommandHandler("export", export))
+    app.add_handler(MessageHandler(filters.Document.ALL, import_document))
+    if state is not None:
+        state.install(app)
     app.run_polling()
 
 if __name__ == "__main__":
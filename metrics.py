@@ -0,0 +1,143 @@
+"""Latency histograms for handlers, Supabase, Telegram and OCR.
+
+Enabled with ``METRICS=true``; the webhook app then serves them in the
+Prometheus text format on ``/metrics``. When disabled, :func:`timed` returns
+handlers undecorated and the observe helpers return after one flag check.
+
+What is recorded:
+
+* ``bot_handler_seconds{handler}`` – time spent in each handler;
+* ``bot_supabase_calls{handler}`` – PostgREST round trips per update, charged
+  to the outermost handler;
+* ``bot_supabase_seconds`` – duration of each round trip;
+* ``bot_telegram_seconds{method}`` – Bot API calls made by the handlers;
+* ``bot_ocr_stage_seconds{stage}`` – download, queue wait, decode,
+  preprocess, the layout and region passes, upscale, each Tesseract pass
+  and parsing.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+ENABLED = os.getenv("METRICS", "").lower() in {"1", "true", "yes"}
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels (Prometheus semantics)."""
+
+    def __init__(self, name: str, description: str, buckets: tuple, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labelnames = labelnames
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        for labels, (counts, total, count) in items:
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            running = 0
+            for le, c in zip((*self.buckets, "+Inf"), counts):
+                running += c
+                out.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {running}')
+            suffix = f"{{{base}}}" if base else ""
+            out.append(f"{self.name}_sum{suffix} {total:.6f}")
+            out.append(f"{self.name}_count{suffix} {count}")
+        return out
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in a handler.", _LATENCY_BUCKETS, ("handler",))
+SUPABASE_CALLS = Histogram(
+    "bot_supabase_calls", "Supabase round trips per update.", _COUNT_BUCKETS, ("handler",)
+)
+SUPABASE_SECONDS = Histogram("bot_supabase_seconds", "Duration of one Supabase round trip.", _LATENCY_BUCKETS)
+TELEGRAM_SECONDS = Histogram(
+    "bot_telegram_seconds", "Duration of one Telegram Bot API call.", _LATENCY_BUCKETS, ("method",)
+)
+OCR_STAGE_SECONDS = Histogram("bot_ocr_stage_seconds", "Duration of one OCR stage.", _LATENCY_BUCKETS, ("stage",))
+REGISTRY = (HANDLER_SECONDS, SUPABASE_CALLS, SUPABASE_SECONDS, TELEGRAM_SECONDS, OCR_STAGE_SECONDS)
+
+# round trips of the update being handled; set by the outermost timed handler
+_supabase_calls: ContextVar[list | None] = ContextVar("supabase_calls", default=None)
+
+
+def timed(fn):
+    """Record a handler's duration and the Supabase round trips of its update."""
+    if not ENABLED:
+        return fn
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        calls = _supabase_calls.get()
+        token = _supabase_calls.set([0]) if calls is None else None
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+            if token is not None:
+                SUPABASE_CALLS.observe(_supabase_calls.get()[0], name)
+                _supabase_calls.reset(token)
+
+    return wrapper
+
+
+def observe_supabase(seconds: float) -> None:
+    SUPABASE_SECONDS.observe(seconds)
+    calls = _supabase_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+
+def observe_ocr(stage: str, seconds: float) -> None:
+    if ENABLED:
+        OCR_STAGE_SECONDS.observe(seconds, stage)
+
+
+def bot_request():
+    """Request backend for ApplicationBuilder().request(): timed when metrics are on, else None."""
+    if not ENABLED:
+        return None
+    # imported here so OCR worker processes, which also import this module, skip PTB
+    from telegram.request import HTTPXRequest
+
+    class TimedHTTPXRequest(HTTPXRequest):
+        async def do_request(self, url: str, method: str, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await super().do_request(url, method, *args, **kwargs)
+            finally:
+                TELEGRAM_SECONDS.observe(time.perf_counter() - started, url.rsplit("/", 1)[-1])
+
+    # 256 is what ApplicationBuilder uses for the bot's own pool
+    return TimedHTTPXRequest(connection_pool_size=256)
+
+
+def render() -> str:
+    return "\n".join(line for h in REGISTRY for line in h.render()) + "\n"
@@ -0,0 +1,639 @@
+"""Receipt OCR.
+
+Tesseract work is CPU-bound and shells out to a subprocess per pass, so it is
+run on a dedicated process pool instead of the bot's event loop. The pool has
+a bounded backlog and a per-user limit; when either is exceeded :func:`run`
+raises :class:`OcrBusy` right away instead of queueing indefinitely.
+
+With ``OCR_ROI`` on (the default) :func:`recognize` first reads the page at
+low resolution to find label anchors (Rp/IDR, NOMINAL, BERITA, Nama
+Penerima, ...) and then runs the high-resolution pass only on the bands
+around them; the full-page cascade is the fallback when that does not yield
+both an amount and a description.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from PIL import Image, ImageOps, ImageEnhance, ImageFilter
+import pytesseract
+from pytesseract import Output
+
+import metrics
+import receipts
+from cache import TTLCache
+from parsing import (
+    _pick_desc_from_text,
+    _pick_amount_from_words,
+    _pick_amount_from_text,
+)
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+# jobs allowed to wait for a free worker before new ones are rejected
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", str(OCR_WORKERS * 2)))
+OCR_PER_USER = int(os.getenv("OCR_PER_USER", "1"))
+# photos larger than this (bytes / decoded pixels) are not OCR'd
+OCR_MAX_BYTES = int(os.getenv("OCR_MAX_BYTES", str(10 * 1024 * 1024)))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(40_000_000)))
+# parsed results of recently seen images; OCR_CACHE_PATH (sqlite) keeps them across restarts
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "512"))
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "")
+# stop the cascade once a pass's mean word confidence reaches this (0-100)
+OCR_MIN_CONF = float(os.getenv("OCR_MIN_CONF", "85"))
+# locate label anchors at low resolution, then OCR only the bands around them
+OCR_ROI = os.getenv("OCR_ROI", "true").lower() in {"1", "true", "yes"}
+# width the layout pass is downscaled to (never upscaled)
+OCR_LAYOUT_WIDTH = int(os.getenv("OCR_LAYOUT_WIDTH", "480"))
+
+# (image variant, lang, psm) in the order they are tried; the cheapest,
+# most often sufficient passes come first
+OCR_CASCADE = (
+    ("gray", "eng+ind", 6),
+    ("bin", "eng+ind", 6),
+    ("gray", "eng+ind", 4),
+    ("gray", "eng", 6),
+    ("bin", "eng+ind", 4),
+    ("gray", "eng+ind", 11),
+    ("bin", "eng", 6),
+    ("gray", "eng", 4),
+    ("bin", "eng", 4),
+    ("bin", "eng+ind", 11),
+    ("gray", "eng", 11),
+    ("bin", "eng", 11),
+)
+
+
+class OcrBusy(Exception):
+    """The OCR pool is saturated (globally or for this user); retry later."""
+
+
+_pool: ProcessPoolExecutor | None = None
+_in_flight = 0
+_per_user: dict[int, int] = {}
+_stats = {"jobs": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0, "last_wait": 0.0}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # never fork the bot process itself: by now it runs the DB thread pool
+        # and an event loop. Workers come from a fresh server process with
+        # this module preloaded.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["ocr"])
+        else:
+            ctx = multiprocessing.get_context("spawn")
+        _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=ctx)
+    return _pool
+
+
+def _replace_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop a pool whose worker died (OOM, Tesseract crash) so the next job gets a fresh one."""
+    global _pool
+    if _pool is broken:
+        _pool = None
+        logging.warning("ocr: worker died, replacing the process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _timed(fn, args):
+    # runs in the worker: report when the job actually started
+    return time.time(), fn(*args)
+
+
+async def run(user_key: int, fn, *args):
+    """Run ``fn(*args)`` on the OCR pool on behalf of ``user_key``."""
+    global _in_flight
+    if _in_flight >= OCR_WORKERS + OCR_QUEUE_SIZE or _per_user.get(user_key, 0) >= OCR_PER_USER:
+        _stats["rejected"] += 1
+        raise OcrBusy()
+    _in_flight += 1
+    _per_user[user_key] = _per_user.get(user_key, 0) + 1
+    submitted = time.time()
+    try:
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        try:
+            started, result = await loop.run_in_executor(pool, _timed, fn, args)
+        except BrokenProcessPool:
+            _replace_pool(pool)
+            raise
+        wait = max(0.0, started - submitted)
+        metrics.observe_ocr("queue_wait", wait)
+        _stats["jobs"] += 1
+        _stats["wait_total"] += wait
+        _stats["wait_max"] = max(_stats["wait_max"], wait)
+        _stats["last_wait"] = wait
+        return result
+    finally:
+        _in_flight -= 1
+        left = _per_user.get(user_key, 1) - 1
+        if left > 0:
+            _per_user[user_key] = left
+        else:
+            _per_user.pop(user_key, None)
+
+
+def queue_depth() -> int:
+    """Jobs submitted but still waiting for a free worker."""
+    return max(0, _in_flight - OCR_WORKERS)
+
+
+def stats() -> dict:
+    jobs = _stats["jobs"]
+    return {
+        "workers": OCR_WORKERS,
+        "in_flight": _in_flight,
+        "queue_depth": queue_depth(),
+        "jobs": jobs,
+        "rejected": _stats["rejected"],
+        "wait_avg": _stats["wait_total"] / jobs if jobs else 0.0,
+        "wait_max": _stats["wait_max"],
+        "last_wait": _stats["last_wait"],
+    }
+
+
+@dataclass
+class Word:
+    text: str
+    conf: float
+    left: int
+    top: int
+    width: int
+    height: int
+
+
+@dataclass
+class OcrResult:
+    """Everything derived from one receipt image.
+
+    Built once per image: the preprocessed variants, the text and word boxes
+    of the pass the cascade settled on, and the fields parsed from them.
+    ``images`` only lives inside the worker and is dropped before the result
+    is sent back to the bot process.
+    """
+    text: str = ""
+    words: list[Word] = field(default_factory=list)
+    confidence: float = 0.0
+    passes: int = 0
+    accepted: bool = False
+    bank_hint: str | None = None
+    desc: str | None = None
+    amount: Decimal | None = None
+    berita_empty: bool = False
+    # pixels handed to Tesseract over all passes
+    pixels: int = 0
+    # (stage, seconds) measured in the worker: decode, preprocess, one
+    # tesseract and one parse entry per pass (layout/roi in ROI mode)
+    timings: list = field(default_factory=list, repr=False)
+    images: dict = field(default_factory=dict, repr=False)
+
+
+def _enhance(img: Image.Image) -> Image.Image:
+    g = ImageOps.grayscale(img)
+    g = ImageOps.autocontrast(g)
+    g = ImageEnhance.Contrast(g).enhance(1.5)
+    return g.filter(ImageFilter.SHARPEN)
+
+
+def _upscale_factor(size: tuple[int, int]) -> float:
+    """Upscale applied to small images before OCR (1.0 = none)."""
+    if 0 < min(size) < 1200:
+        return max(1.8, 1200 / float(min(size)))
+    return 1.0
+
+
+def _scaled(g: Image.Image, scale: float) -> Image.Image:
+    if scale == 1.0:
+        return g
+    try:
+        return g.resize((int(g.width * scale), int(g.height * scale)), Image.LANCZOS)
+    except Exception:
+        return g
+
+
+def _variant(images: dict, name: str) -> Image.Image:
+    if name not in images:
+        g = images["gray"]
+        try:
+            images[name] = g.point(lambda x: 255 if x > 180 else 0)
+        except Exception:
+            images[name] = g
+    return images[name]
+
+
+def _read_data(data: dict) -> tuple[str, list[Word], float]:
+    """Line-broken text, words with boxes, and mean word confidence from ``image_to_data``."""
+    lines: list[str] = []
+    words: list[Word] = []
+    current = None
+    line_words: list[str] = []
+    for i, w in enumerate(data.get("text", [])):
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key != current:
+            if line_words:
+                lines.append(" ".join(line_words))
+            current, line_words = key, []
+        w = (w or "").strip()
+        if not w:
+            continue
+        line_words.append(w)
+        try:
+            conf = float(data["conf"][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        words.append(Word(
+            w, conf,
+            int(data["left"][i]), int(data["top"][i]),
+            int(data["width"][i]), int(data["height"][i]),
+        ))
+    if line_words:
+        lines.append(" ".join(line_words))
+    confs = [w.conf for w in words if w.conf >= 0]
+    return "\n".join(lines), words, (sum(confs) / len(confs) if confs else 0.0)
+
+
+# ---------- Region of interest ----------
+
+# label lines worth a high-resolution read, with how many following lines hold their value
+_ANCHORS = (
+    (re.compile(rf"^(?:{'|'.join(receipts.DESC_LABELS)})(?![A-Za-z0-9])", re.I), 2),
+    (re.compile(
+        rf"^(?:{'|'.join(receipts.MERCHANT_LABELS + receipts.PARTY_LABELS + receipts.AMOUNT_LABELS)})"
+        r"(?![A-Za-z0-9])",
+        re.I,
+    ), 1),
+    (receipts.CURRENCY, 0),
+)
+# blank rows between stacked regions so Tesseract keeps them apart
+_ROI_GAP = 24
+
+
+def _line_boxes(data: dict, scale: float = 1.0) -> list[tuple]:
+    """(text, left, top, right, bottom) per line of ``image_to_data`` output, top to bottom.
+
+    Coordinates are divided by ``scale``.
+    """
+    boxes: dict[tuple, list] = {}
+    for i, w in enumerate(data.get("text", [])):
+        w = (w or "").strip()
+        if not w:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        left, top = int(data["left"][i]), int(data["top"][i])
+        right, bottom = left + int(data["width"][i]), top + int(data["height"][i])
+        box = boxes.get(key)
+        if box is None:
+            boxes[key] = [[w], left, top, right, bottom]
+        else:
+            box[0].append(w)
+            box[1:] = min(box[1], left), min(box[2], top), max(box[3], right), max(box[4], bottom)
+    lines = [(" ".join(b[0]), *(int(v / scale) for v in b[1:])) for b in boxes.values()]
+    return sorted(lines, key=lambda line: line[2])
+
+
+def plan_regions(lines: list[tuple], size: tuple[int, int]) -> list[tuple[int, int, int, int]]:
+    """Boxes (left, top, right, bottom) worth reading at high resolution.
+
+    Each anchor line is taken with the lines holding its value (when they
+    start within three line heights) and cropped to their ink; boxes that overlap
+    vertically are merged.
+    """
+    width, height = size
+    boxes = []
+    for i, (text, left, top, right, bottom) in enumerate(lines):
+        follow = next((n for pattern, n in _ANCHORS if pattern.search(text)), None)
+        if follow is None:
+            continue
+        line_h = max(1, bottom - top)
+        for line in lines[i + 1:i + 1 + follow]:
+            if line[2] - bottom > 3 * line_h:
+                break
+            left, right, bottom = min(left, line[1]), max(right, line[3]), max(bottom, line[4])
+        pad = max(4, line_h // 2)
+        boxes.append((max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad)))
+    merged: list[tuple[int, int, int, int]] = []
+    for left, top, right, bottom in sorted(boxes, key=lambda b: b[1]):
+        if merged and top <= merged[-1][3]:
+            m = merged[-1]
+            merged[-1] = (min(m[0], left), m[1], max(m[2], right), max(m[3], bottom))
+        else:
+            merged.append((left, top, right, bottom))
+    return merged
+
+
+def _layout_scale(size: tuple[int, int]) -> float:
+    return min(1.0, OCR_LAYOUT_WIDTH / float(size[0])) if size[0] else 1.0
+
+
+def roi_pixels(size: tuple[int, int], regions: list[tuple[int, int, int, int]]) -> int:
+    """Pixels Tesseract reads in ROI mode: the layout pass plus the stacked regions."""
+    s, f = _layout_scale(size), _upscale_factor(size)
+    pixels = int(size[0] * s) * int(size[1] * s)
+    if regions:
+        width = max(int((r - l) * f) for l, _, r, _ in regions)
+        pixels += width * (sum(int((b - t) * f) for _, t, _, b in regions) + _ROI_GAP * (len(regions) - 1))
+    return pixels
+
+
+def _stack(base: Image.Image, regions: list[tuple[int, int, int, int]], scale: float):
+    """``regions`` of ``base`` upscaled and stacked into one image.
+
+    Also returns (offset, end, left, top) per region: its rows in the stacked
+    image (including the gap below it) and its origin in ``base``.
+    """
+    crops = [_scaled(base.crop(box), scale) for box in regions]
+    height = sum(c.height for c in crops) + _ROI_GAP * (len(crops) - 1)
+    canvas = Image.new("L", (max(c.width for c in crops), height), 255)
+    placed = []
+    y = 0
+    for crop, (left, top, _, _) in zip(crops, regions):
+        canvas.paste(crop, (0, y))
+        placed.append((y, y + crop.height + _ROI_GAP, left, top))
+        y += crop.height + _ROI_GAP
+    return canvas, placed
+
+
+def _recognize_roi(base: Image.Image, timings: list) -> OcrResult:
+    """Layout pass at low resolution, then one high-resolution pass over the anchor bands.
+
+    Lines outside the bands keep their low-resolution text, so bank keywords
+    and section labels are still there for :func:`parse_fields`.
+    """
+    config = "--oem 3 --psm 6 -c preserve_interword_spaces=1"
+    small_scale = _layout_scale(base.size)
+    small = _scaled(base, small_scale)
+    res = OcrResult(passes=1, pixels=small.width * small.height)
+    started = time.perf_counter()
+    try:
+        layout = pytesseract.image_to_data(small, lang="eng+ind", config=config, output_type=Output.DICT)
+    except Exception:
+        return res
+    finally:
+        timings.append(("layout", time.perf_counter() - started))
+    lines = _line_boxes(layout, small_scale)
+    regions = plan_regions(lines, base.size)
+    if not regions:
+        return res
+
+    scale = _upscale_factor(base.size)
+    canvas, placed = _stack(base, regions, scale)
+    res.passes += 1
+    res.pixels += canvas.width * canvas.height
+    started = time.perf_counter()
+    try:
+        data = pytesseract.image_to_data(canvas, lang="eng+ind", config=config, output_type=Output.DICT)
+    except Exception:
+        return res
+    finally:
+        timings.append(("roi", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    ends = [p[1] for p in placed]
+    roi_lines: list[list[str]] = [[] for _ in regions]
+    for text, _, top, _, bottom in _line_boxes(data):
+        k = next((k for k, end in enumerate(ends) if (top + bottom) / 2 < end), len(ends) - 1)
+        roi_lines[k].append(text)
+    # low-resolution text with each region's lines swapped for the high-resolution read
+    out: list[str] = []
+    emitted = set()
+    for text, _, top, _, bottom in lines:
+        centre = (top + bottom) / 2
+        k = next((k for k, (_, t, _, b) in enumerate(regions) if t <= centre < b), None)
+        if k is None or not roi_lines[k]:
+            out.append(text)
+        elif k not in emitted:
+            emitted.add(k)
+            out.extend(roi_lines[k])
+    _, words, conf = _read_data(data)
+    for w in words:
+        k = next((k for k, end in enumerate(ends) if w.top < end), len(ends) - 1)
+        offset, _, left, top = placed[k]
+        w.left, w.width, w.height = left + int(w.left / scale), int(w.width / scale), int(w.height / scale)
+        w.top = top + int((w.top - offset) / scale)
+    parsed = parse_fields(OcrResult(text="\n".join(out), words=words, confidence=conf))
+    timings.append(("parse", time.perf_counter() - started))
+    parsed.passes, parsed.pixels = res.passes, res.pixels
+    return parsed
+
+
+def parse_fields(res: OcrResult) -> OcrResult:
+    """Fill ``bank_hint``/``desc``/``amount``/``berita_empty`` from ``res.text`` and ``res.words``."""
+    text = res.text
+    parsed = receipts.parse(text)
+    res.bank_hint = parsed["bank"]
+    desc = parsed["desc"]
+    amount = parsed["amount"]
+    res.berita_empty = parsed["berita_empty"] and not desc
+    if not desc:
+        desc = _pick_desc_from_text(text)
+    if amount is None:
+        amount = _pick_amount_from_text(text)
+    if amount is None:
+        amount = _pick_amount_from_words([w.text for w in res.words])
+    res.desc = desc
+    res.amount = amount
+    return res
+
+
+def _complete(res: OcrResult) -> bool:
+    return res.amount is not None and bool(res.desc) and len(res.desc) >= 3
+
+
+def _score(res: OcrResult) -> tuple[int, float]:
+    return int(res.amount is not None) + int(bool(res.desc)), res.confidence
+
+
+def recognize(img: Image.Image) -> OcrResult:
+    """Preprocess ``img`` once and OCR it: anchor regions first, then the full-page cascade.
+
+    In ROI mode a result with both an amount and a description ends the job
+    after two Tesseract passes. Otherwise the cascade stops at the first pass
+    whose parsed fields include both, or whose mean word confidence reaches
+    ``OCR_MIN_CONF``.
+    """
+    started = time.perf_counter()
+    base = _enhance(img)
+    timings = [("preprocess", time.perf_counter() - started)]
+    best = OcrResult()
+    best_score = (-1, -1.0)
+    passes = pixels = 0
+    if OCR_ROI:
+        res = _recognize_roi(base, timings)
+        if _complete(res):
+            res.accepted = True
+            res.timings = timings
+            return res
+        passes, pixels = res.passes, res.pixels
+        if res.text:
+            best, best_score = res, _score(res)
+    started = time.perf_counter()
+    images = {"gray": _scaled(base, _upscale_factor(img.size))}
+    timings.append(("upscale", time.perf_counter() - started))
+    for variant, lang, psm in OCR_CASCADE:
+        config = f"--oem 3 --psm {psm} -c preserve_interword_spaces=1"
+        passes += 1
+        image = _variant(images, variant)
+        pixels += image.width * image.height
+        started = time.perf_counter()
+        try:
+            data = pytesseract.image_to_data(image, lang=lang, config=config, output_type=Output.DICT)
+        except Exception:
+            continue
+        finally:
+            timings.append(("tesseract", time.perf_counter() - started))
+        started = time.perf_counter()
+        text, words, conf = _read_data(data)
+        res = parse_fields(OcrResult(text=text, words=words, confidence=conf))
+        timings.append(("parse", time.perf_counter() - started))
+        if _complete(res) or (text and conf >= OCR_MIN_CONF):
+            res.accepted = True
+            best = res
+            break
+        score = _score(res)
+        if score > best_score:
+            best, best_score = res, score
+    best.passes = passes
+    best.pixels = pixels
+    best.timings = timings
+    best.images = images
+    return best
+
+
+def read_receipt(data: bytes) -> OcrResult:
+    """Worker entry point: decode (once, in memory), OCR and parse one receipt image."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # header only so far; refuse decompression bombs before decoding
+            if img.width * img.height > OCR_MAX_PIXELS:
+                return OcrResult()
+            started = time.perf_counter()
+            img.load()
+            decoded = time.perf_counter() - started
+            res = recognize(img)
+    except Exception:
+        return OcrResult()
+    res.timings.insert(0, ("decode", decoded))
+    # preprocessed images stay in the worker
+    res.images = {}
+    return res
+
+
+# ---------- Result cache ----------
+def content_hash(data: bytes) -> str:
+    """Cache key for the image content.
+
+    An exact digest rather than a perceptual hash: two receipts from the same
+    bank app differ only in a few digits and would share a perceptual hash.
+    """
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def _result_to_json(res: OcrResult) -> str:
+    return json.dumps({
+        "text": res.text,
+        "confidence": res.confidence,
+        "passes": res.passes,
+        "accepted": res.accepted,
+        "bank_hint": res.bank_hint,
+        "desc": res.desc,
+        "amount": str(res.amount) if res.amount is not None else None,
+        "berita_empty": res.berita_empty,
+    })
+
+
+def _result_from_json(raw: str) -> OcrResult:
+    d = json.loads(raw)
+    amount = d.pop("amount", None)
+    return OcrResult(amount=Decimal(amount) if amount is not None else None, **d)
+
+
+class ResultCache:
+    """LRU of parsed OCR results (without word boxes), optionally backed by sqlite.
+
+    Memory hits are answered inline; sqlite reads and writes run on a thread
+    so they never block the event loop.
+    """
+
+    def __init__(self, maxsize: int, path: str = ""):
+        self.maxsize = maxsize
+        self._mem = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "create table if not exists ocr_cache (key text primary key, value text not null, used real not null)"
+            )
+            self._db.commit()
+
+    async def get(self, key: str) -> OcrResult | None:
+        if not key:
+            return None
+        raw = self._mem.get(key)
+        if raw is None and self._db is not None:
+            raw = await asyncio.to_thread(self._db_get, key)
+            if raw is not None:
+                self._mem.set(key, raw)
+        return _result_from_json(raw) if raw is not None else None
+
+    async def put(self, keys: list[str], res: OcrResult) -> None:
+        raw = _result_to_json(res)
+        keys = [k for k in keys if k]
+        for k in keys:
+            self._mem.set(k, raw)
+        if self._db is not None and keys:
+            await asyncio.to_thread(self._db_put, keys, raw)
+
+    def _db_get(self, key: str) -> str | None:
+        with self._db_lock:
+            row = self._db.execute("select value from ocr_cache where key = ?", (key,)).fetchone()
+            if row:
+                self._db.execute("update ocr_cache set used = ? where key = ?", (time.time(), key))
+                self._db.commit()
+        return row[0] if row else None
+
+    def _db_put(self, keys: list[str], raw: str) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._db.executemany(
+                "insert or replace into ocr_cache (key, value, used) values (?, ?, ?)",
+                [(k, raw, now) for k in keys],
+            )
+            self._db.execute(
+                "delete from ocr_cache where key not in "
+                "(select key from ocr_cache order by used desc limit ?)",
+                (self.maxsize,),
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        return self._mem.stats()
+
+
+_result_cache: ResultCache | None = None
+
+
+def result_cache() -> ResultCache:
+    """The bot process's result cache, built on first use.
+
+    Not at import time: pool workers import this module too (the forkserver
+    preloads it) and must not open the sqlite file or inherit its connection.
+    """
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(OCR_CACHE_SIZE, OCR_CACHE_PATH)
+    return _result_cache
@@ -0,0 +1,193 @@
+"""Text heuristics for amounts, descriptions and receipts.
+
+Pure functions with no Telegram/Supabase/OCR imports, so they can run inside
+the OCR worker processes as well as in the handlers.
+"""
+import re
+from decimal import Decimal, InvalidOperation, ROUND_DOWN
+
+def _parse_amount(text: str) -> Decimal:
+    s = (text or "").strip()
+    # Keep digits and separators, strip any spaces including NBSP
+    filtered = "".join(ch for ch in s if ch.isdigit() or ch in ",.")
+    if not filtered:
+        raise ValueError("Nominal tidak valid")
+
+    has_comma = "," in filtered
+    has_dot = "." in filtered
+
+    if has_comma and has_dot:
+        # Decide decimal by the rightmost separator among comma/dot
+        last_comma = filtered.rfind(",")
+        last_dot = filtered.rfind(".")
+        if last_comma > last_dot:
+            # comma is decimal: drop all dots, replace last comma with dot
+            filtered = filtered.replace(".", "")
+            # replace ALL commas with dot, since previous commas could be decimals in OCR noise
+            filtered = filtered.replace(",", ".")
+        else:
+            # dot is decimal: drop all commas
+            filtered = filtered.replace(",", "")
+    elif has_comma and not has_dot:
+        # Only commas present. If multiple commas, treat last as decimal and others as thousands
+        if filtered.count(",") > 1:
+            last = filtered.rfind(",")
+            filtered = filtered[:last].replace(",", "") + "." + filtered[last+1:]
+        else:
+            filtered = filtered.replace(",", ".")
+    elif has_dot and not has_comma:
+        # Only dots present. Decide whether they are thousands separators or decimal.
+        parts = filtered.split(".")
+        if len(parts) == 1:
+            pass  # no-op
+        elif len(parts) == 2:
+            # One dot: if right side has length 3, treat as thousands (e.g., 20.000 -> 20000)
+            if len(parts[1]) == 3 and len(parts[0]) >= 1:
+                filtered = parts[0] + parts[1]
+            else:
+                # Treat as decimal (e.g., 20.5)
+                filtered = parts[0] + "." + parts[1]
+        else:
+            # Multiple dots
+            right_len = len(parts[-1])
+            left_ok = 1 <= len(parts[0]) <= 3
+            middle_ok = all(len(p) == 3 for p in parts[1:-1])
+            if right_len == 3 and left_ok and middle_ok:
+                # Pure thousands grouping: 1.234.567 -> 1234567
+                filtered = "".join(parts)
+            elif right_len in (1, 2):
+                # Likely decimal with thousands before: 1.234.56 or 1.234.5 -> 1234.56 / 1234.5
+                filtered = "".join(parts[:-1]) + "." + parts[-1]
+            else:
+                # Ambiguous; prefer treating as thousands: 12.3456.789 -> 123456789
+                filtered = "".join(parts)
+    # else: only digits
+
+    try:
+        return Decimal(filtered)
+    except InvalidOperation:
+        raise ValueError("Nominal tidak valid")
+
+def _first_sentence(text: str) -> str:
+    s = (text or "").strip()
+    for sep in [".", "!", "?", "\n"]:
+        idx = s.find(sep)
+        if idx != -1:
+            s = s[:idx]
+            break
+    return s.strip()
+
+# Same grammar as shlex.split(): words of unquoted chars, backslash escapes,
+# '...' and "..." runs, separated by ASCII whitespace; anything else (an
+# unclosed quote or a trailing backslash) makes the line unsplittable.
+_WS = re.compile(r"[ \t\r\n]+")
+_WORD = re.compile(
+    r"""[ \t\r\n]+|((?:[^ \t\r\n'"\\]|\\.|'[^']*'|"(?:[^"\\]|\\.)*")+)|(.)""", re.S
+)
+_WORD_PIECE = re.compile(r"""\\(.)|'([^']*)'|"((?:[^"\\]|\\.)*)"|([^'"\\]+)""", re.S)
+_DQ_ESCAPE = re.compile(r'\\([\\"])')
+
+def _unquote(m: re.Match) -> str:
+    escaped, single, double, plain = m.groups()
+    if double is not None:
+        return _DQ_ESCAPE.sub(r"\1", double)
+    return next(p for p in (escaped, single, plain) if p is not None)
+
+def _split_words(text: str) -> list[str] | None:
+    """shlex.split(text) in one regex sweep; None where shlex would raise."""
+    if not any(c in text for c in "'\"\\"):
+        return [w for w in _WS.split(text) if w]
+    words = []
+    for m in _WORD.finditer(text):
+        word, bad = m.groups()
+        if bad is not None:
+            return None
+        if word is not None:
+            words.append(_WORD_PIECE.sub(_unquote, word))
+    return words
+
+def _pick_desc_from_text(text: str) -> str:
+    # choose the first non-trivial line
+    for line in (text or "").splitlines():
+        s = line.strip()
+        if len(s) >= 3 and not re.fullmatch(r"[0-9\s\-:./,]+", s):
+            return _first_sentence(s)
+    # fallback to first sentence of whole text
+    return _first_sentence(text)
+
+def _pick_amount_from_text(text: str) -> Decimal | None:
+    """Heuristics to pick amount from OCR text.
+    Priority:
+    1) Tokens near currency markers (IDR/Rp)
+    2) Tokens containing separators (comma/dot)
+    Avoid long integer strings (likely reference numbers).
+    """
+    t = text or ""
+    # 1) Contextual: after IDR/Rp
+    ctx_tokens = re.findall(r"(?:IDR|Rp)\s*([0-9][0-9.,\s\u00A0\u202F]{1,})", t, re.I)
+    for tok in ctx_tokens:
+        try:
+            return _parse_amount(tok)
+        except Exception:
+            continue
+    # 2) Any number that has thousand/decimal separators
+    tokens = re.findall(r"([0-9][0-9.,]{2,})", t)
+    best: Decimal | None = None
+    for tok in tokens:
+        # skip plain long integers (no separators)
+        if "," not in tok and "." not in tok:
+            continue
+        try:
+            val = _parse_amount(tok)
+        except Exception:
+            continue
+        if best is None or val > best:
+            best = val
+    return best
+
+def _pick_amount_from_words(words: list[str]) -> Decimal | None:
+    """Amount from word-level OCR tokens: the words after IDR/Rp first,
+    else the largest token with separators."""
+    # 1) look for IDR/Rp then next few tokens
+    for i, w in enumerate(words):
+        if not w:
+            continue
+        t = w.strip()
+        if t.upper() in {"IDR", "RP"}:
+            buf = []
+            for j in range(1, 6):
+                k = i + j
+                if k >= len(words):
+                    break
+                t2 = (words[k] or "").strip()
+                if not t2:
+                    continue
+                buf.append(t2)
+            candidate = " ".join(buf)
+            try:
+                val = _parse_amount(candidate)
+                return val
+            except Exception:
+                continue
+
+    # 2) fallback: any numeric token with separators
+    best: Decimal | None = None
+    for w in words:
+        t = (w or "").strip()
+        if not t:
+            continue
+        if "," in t or "." in t:
+            try:
+                v = _parse_amount(t)
+            except Exception:
+                continue
+            if best is None or v > best:
+                best = v
+    return best
+
+def _normalize_ocr_amount(amount: Decimal) -> Decimal:
+    """For OCR sources, drop fractional part (e.g., 27,500.00 -> 27500)."""
+    try:
+        return amount.quantize(Decimal("1"), rounding=ROUND_DOWN)
+    except Exception:
+        return amount
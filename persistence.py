@@ -0,0 +1,321 @@
+"""Conversation state and ``user_data`` that survive restarts and instance hops.
+
+PTB keeps ``ConversationHandler`` states and ``context.user_data`` in process
+memory, so under several webhook instances a user's next message may land
+where nobody knows the conversation. :class:`StatePersistence` is a PTB
+persistence backed by a small key/value store (SQLite locally, the
+``bot_state`` table through Supabase in production):
+
+* reads are read-through: before the handlers run, the rows for this
+  update's user and conversation are loaded unless the in-memory copy is
+  younger than ``STATE_CACHE_TTL``;
+* writes happen only when a state or ``user_data`` actually changed, and all
+  changes pending at flush time go out as one batch.
+
+``STATE_STORE`` selects ``memory`` (default, PTB's in-process behaviour),
+``sqlite`` or ``postgres``.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput, TypeHandler
+
+import db
+from cache import TTLCache
+
+STATE_STORE = os.getenv("STATE_STORE", "memory").lower()
+STATE_PATH = os.getenv("STATE_PATH", "state.sqlite3")
+# How long a loaded row is trusted without re-reading the store. Several
+# instances may serve the same user on serverless, so there it defaults to 0.
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", "0" if os.getenv("VERCEL") else "300"))
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+
+
+# ---------- encoding ----------
+def _pack(obj):
+    """JSON-safe copy of ``obj``; Decimals and tuples are tagged to round-trip."""
+    if isinstance(obj, Decimal):
+        return {"$decimal": str(obj)}
+    if isinstance(obj, tuple):
+        return {"$tuple": [_pack(v) for v in obj]}
+    if isinstance(obj, list):
+        return [_pack(v) for v in obj]
+    if isinstance(obj, dict):
+        return {str(k): _pack(v) for k, v in obj.items()}
+    return obj
+
+
+def _unpack_hook(d: dict):
+    if len(d) == 1:
+        if "$decimal" in d:
+            return Decimal(d["$decimal"])
+        if "$tuple" in d:
+            return tuple(d["$tuple"])
+    return d
+
+
+def encode(value) -> str:
+    return json.dumps(_pack(value), sort_keys=True, separators=(",", ":"))
+
+
+def decode(raw: str):
+    return json.loads(raw, object_hook=_unpack_hook)
+
+
+# ---------- stores ----------
+class SqliteStateStore:
+    """``key -> JSON text`` table in a local SQLite file."""
+
+    def __init__(self, path: str = STATE_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute(
+                "create table if not exists bot_state (key text primary key, value text not null)"
+            )
+        return self._conn
+
+    def _read(self, keys: list[str]) -> dict[str, str]:
+        marks = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._db().execute(f"select key, value from bot_state where key in ({marks})", keys)
+            return dict(rows.fetchall())
+
+    def _write(self, rows: dict[str, str | None]) -> None:
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute("begin")
+                conn.executemany(
+                    "insert into bot_state (key, value) values (?, ?) "
+                    "on conflict (key) do update set value = excluded.value",
+                    [(k, v) for k, v in rows.items() if v is not None],
+                )
+                conn.executemany(
+                    "delete from bot_state where key = ?", [(k,) for k, v in rows.items() if v is None]
+                )
+
+    async def read(self, keys: list[str]) -> dict[str, str]:
+        return await asyncio.to_thread(self._read, keys) if keys else {}
+
+    async def write(self, rows: dict[str, str | None]) -> None:
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+
+
+class PostgresStateStore:
+    """The ``bot_state`` table (sql/005_bot_state.sql) through Supabase."""
+
+    async def read(self, keys: list[str]) -> dict[str, str]:
+        # re-encode like encode() so _stage's text comparison sees unchanged rows as equal
+        return {
+            k: json.dumps(v, sort_keys=True, separators=(",", ":"))
+            for k, v in (await db.fetch_state(keys)).items()
+        }
+
+    async def write(self, rows: dict[str, str | None]) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        upserts = [{"key": k, "value": json.loads(v), "updated_at": now} for k, v in rows.items() if v is not None]
+        deletes = [k for k, v in rows.items() if v is None]
+        await asyncio.gather(db.upsert_state(upserts), db.delete_state(deletes))
+
+
+# ---------- PTB persistence ----------
+def _user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _conv_key(name: str, key: tuple) -> str:
+    return f"conv:{name}:" + ":".join(str(k) for k in key)
+
+
+class StatePersistence(BasePersistence):
+    """Read-through, change-only, coalescing persistence for conversations and user_data.
+
+    PTB only loads persisted data at startup and writes it back on a timer;
+    :meth:`install` adds two handlers around the regular ones so each update
+    reads fresh state first and writes its changes right after.
+    """
+
+    def __init__(self, store, cache_ttl: float = STATE_CACHE_TTL, cache_size: int = STATE_CACHE_SIZE):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=60,
+        )
+        self.store = store
+        self.cache_ttl = cache_ttl
+        # key -> (JSON text last read/written or None, monotonic time it was read)
+        self._known = TTLCache(maxsize=cache_size, ttl=max(cache_ttl, 3600.0))
+        self._dirty: dict[str, str | None] = {}
+        self._flush_lock = asyncio.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.unchanged = 0
+
+    # -- startup: nothing is preloaded, rows are read when their user shows up
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    # -- change tracking
+    def _stage(self, key: str, raw: str | None) -> None:
+        known = self._known.get(key)
+        if known is not None and known[0] == raw:
+            self.unchanged += 1
+            return
+        self._dirty[key] = raw
+        self._known.set(key, (raw, time.monotonic()))
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        self._stage(_conv_key(name, key), None if new_state is None else encode(new_state))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage(_user_key(user_id), encode(data) if data else None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage(_user_key(user_id), None)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Write every staged change in one batch; concurrent callers share it."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            rows, self._dirty = self._dirty, {}
+            try:
+                await self.store.write(rows)
+                self.writes += len(rows)
+            except Exception:
+                # forget what we believed was stored so the next update re-stages it
+                for key in rows:
+                    self._known.invalidate(key)
+                raise
+
+    # -- per-update hooks
+    def install(self, application, group: int = -1) -> None:
+        """Load state before handler ``group`` 0 and persist changes after it."""
+        application.add_handler(TypeHandler(Update, self._load), group=group)
+        application.add_handler(TypeHandler(Update, self._save), group=-group)
+
+    def _conversation_keys(self, application, update: Update):
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if not (isinstance(handler, ConversationHandler) and handler.persistent):
+                    continue
+                if handler.per_message:
+                    continue
+                chat, user = update.effective_chat, update.effective_user
+                if (handler.per_chat and chat is None) or (handler.per_user and user is None):
+                    continue
+                key = []
+                if handler.per_chat:
+                    key.append(chat.id)
+                if handler.per_user:
+                    key.append(user.id)
+                yield handler, tuple(key)
+
+    async def _load(self, update: Update, context) -> None:
+        application = context.application
+        targets: dict[str, tuple] = {}
+        if update.effective_user is not None:
+            targets[_user_key(update.effective_user.id)] = ("user", None)
+        for handler, key in self._conversation_keys(application, update):
+            targets[_conv_key(handler.name, key)] = (handler, key)
+
+        now = time.monotonic()
+        stale = [k for k in targets if (self._known.get(k) or (None, -1e18))[1] + self.cache_ttl <= now]
+        if not stale:
+            return
+        rows = await self.store.read(stale)
+        self.reads += 1
+        for k in stale:
+            raw = rows.get(k)
+            self._known.set(k, (raw, now))
+            target, key = targets[k]
+            value = None if raw is None else decode(raw)
+            if target == "user":
+                context.user_data.clear()
+                context.user_data.update(value or {})
+                continue
+            # ConversationHandler has no public hook for this; write without
+            # marking the key as changed so it is not echoed back to the store
+            states = target._conversations
+            if value is None:
+                states.data.pop(key, None)
+            else:
+                states.update_no_track({key: value})
+
+    async def _save(self, update: Update, context) -> None:
+        application = context.application
+        if update.effective_user is not None:
+            application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
+        try:
+            await application.update_persistence()
+            await self.flush()
+        except Exception:
+            logging.exception("state: failed to persist update %s", update.update_id)
+
+    def stats(self) -> dict:
+        return {
+            "store": type(self.store).__name__,
+            "reads": self.reads,
+            "writes": self.writes,
+            "unchanged": self.unchanged,
+            "pending": len(self._dirty),
+            "cached": len(self._known),
+        }
+
+
+def build() -> StatePersistence | None:
+    """The persistence selected by ``STATE_STORE``, or None to keep PTB's in-memory state."""
+    if STATE_STORE == "sqlite":
+        return StatePersistence(SqliteStateStore())
+    if STATE_STORE == "postgres":
+        return StatePersistence(PostgresStateStore())
+    if STATE_STORE != "memory":
+        raise ValueError(f"STATE_STORE must be memory, sqlite or postgres, not {STATE_STORE!r}")
+    return None
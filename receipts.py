@@ -0,0 +1,263 @@
+"""Receipt parsers per bank and e-wallet, picked by one keyword scan.
+
+Each :class:`ReceiptFormat` names the keywords that identify its receipts
+and the labels they use; :func:`register` adds it to the registry.
+:func:`detect` scans the OCR text once with a single regex holding every
+keyword of every format, arranged as a trie (``B(?:CA|NI|RI(?:MO)?)|…``), so
+the work per character depends on keyword length rather than on how many
+formats are registered. :meth:`ReceiptFormat.parse` then reads amount and
+description in one pass over the lines with precompiled patterns.
+
+Like :mod:`parsing`, this module has no Telegram/Supabase/OCR imports.
+"""
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from parsing import _first_sentence, _parse_amount
+
+# ---------- Labels ----------
+
+# Regex fragments matched case-insensitively at the start of a line. The value
+# follows on the same line (after an optional ':' or '-') or on the next one.
+DESC_LABELS = (r"BERITA", r"KETERANGAN", r"CATATAN", r"PESAN", r"DESKRIPSI")
+MERCHANT_LABELS = (r"NAMA\s+MERCHANT", r"MERCHANT", r"NAMA\s+TOKO")
+PARTY_LABELS = (r"NAMA\s+PENERIMA", r"PENERIMA", r"TRANSFER\s+KE", r"KREDIT\s+KE", r"KE")
+AMOUNT_LABELS = (
+    r"NOMINAL(?:\s+TUJUAN)?",
+    r"JUMLAH(?:\s+TRANSFER)?",
+    r"TOTAL(?:\s+(?:BAYAR|TRANSAKSI|PEMBAYARAN))?",
+)
+# labels with no value we use; they end a multi-line description
+STOP_LABELS = (
+    r"NO\.?\s*REF(?:ERENSI)?", r"NOMOR\s+REFERENSI", r"NO\.?\s*JURNAL", r"ID\s+TRANSAKSI",
+    r"REKENING\s+TUJUAN", r"DARI\s+REKENING", r"SUMBER\s+DANA", r"JENIS\s+TRANSAKSI",
+    r"MATA\s+UANG", r"METODE\s+PEMBAYARAN", r"BIAYA(?:\s+ADMIN)?", r"TANGGAL", r"WAKTU",
+    r"STATUS", r"NMID", r"TRANSFER\s+BERHASIL",
+)
+
+_NUMBER = re.compile(r"[0-9][0-9.,]{2,}")
+CURRENCY = re.compile(r"\b(?:RP|IDR)(?![A-Z])", re.I)
+# columns merged onto one line: "BUDI SANTOSO   Rp 150.000"
+_PARTY_TAIL = re.compile(r"\s{2,}|\s*\bRp\b", re.I)
+
+
+def _amount_in(s: str) -> Decimal | None:
+    m = _NUMBER.search(s)
+    if not m:
+        return None
+    try:
+        return _parse_amount(m.group())
+    except Exception:
+        return None
+
+
+# ---------- Formats ----------
+
+@dataclass(frozen=True)
+class ReceiptFormat:
+    """How one bank's or wallet's receipts look.
+
+    ``weight`` scales keyword hits during detection (payment networks such as
+    QRIS appear on issuers' receipts too); ``account`` says whether ``name`` is
+    also where the money came from, i.e. a sensible default for the bank field.
+    """
+    name: str
+    keywords: tuple[str, ...]
+    weight: float = 1.0
+    account: bool = True
+    desc_labels: tuple[str, ...] = DESC_LABELS
+    merchant_labels: tuple[str, ...] = MERCHANT_LABELS
+    party_labels: tuple[str, ...] = PARTY_LABELS
+    amount_labels: tuple[str, ...] = AMOUNT_LABELS
+    stop_labels: tuple[str, ...] = STOP_LABELS
+    # lines that are a description by themselves, e.g. "GoFood - Nasi Padang"
+    desc_lines: tuple[str, ...] = ()
+    _labels: re.Pattern = field(init=False, repr=False, compare=False)
+    _desc_line: re.Pattern | None = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        groups = (
+            ("desc", self.desc_labels), ("merchant", self.merchant_labels),
+            ("party", self.party_labels), ("amount", self.amount_labels), ("stop", self.stop_labels),
+        )
+        alts = "|".join(f"(?P<{role}>{'|'.join(labels)})" for role, labels in groups if labels)
+        object.__setattr__(self, "_labels", re.compile(rf"(?:{alts})(?![A-Za-z0-9])", re.I))
+        object.__setattr__(
+            self, "_desc_line", re.compile("|".join(self.desc_lines), re.I) if self.desc_lines else None
+        )
+
+    def parse(self, text: str) -> dict:
+        """Amount, description and whether the description field was present but empty.
+
+        Keys: ``bank``, ``amount``, ``desc``, ``berita_empty``. Description
+        preference: the first description label (BERITA/Keterangan/…, possibly
+        spanning lines until the next label), then the merchant, then a
+        ``desc_lines`` match, then "Transfer ke <recipient>".
+        """
+        amount: Decimal | None = None
+        merchant = party = line_desc = None
+        desc_parts: list[str] | None = None
+        pending = None  # role whose value is on the following line(s)
+        for raw in (text or "").splitlines():
+            line = raw.strip()
+            if not line:
+                continue
+            m = self._labels.match(line)
+            if m is None:
+                if pending == "desc":
+                    desc_parts.append(line)
+                    continue
+                if pending == "merchant":
+                    merchant = line
+                elif pending == "party":
+                    party = line
+                elif amount is None and (pending == "amount" or CURRENCY.search(line)):
+                    amount = _amount_in(line)
+                elif line_desc is None and self._desc_line is not None and self._desc_line.match(line):
+                    line_desc = line
+                pending = None
+                continue
+
+            role = m.lastgroup
+            rest = line[m.end():].strip().lstrip(":-").strip()
+            pending = None
+            if role == "desc":
+                if desc_parts is None:
+                    desc_parts = [rest] if rest else []
+                    pending = None if rest else "desc"
+            elif role == "amount":
+                if amount is None:
+                    amount = _amount_in(rest)
+                    pending = "amount" if amount is None else None
+            elif role == "merchant":
+                if merchant is None:
+                    merchant = rest or None
+                    pending = None if rest else "merchant"
+            elif role == "party":
+                if party is None:
+                    party = _PARTY_TAIL.split(rest, maxsplit=1)[0].strip() or None
+                    pending = None if rest else "party"
+
+        desc_text = " ".join(desc_parts or ()).strip()
+        desc = _first_sentence(desc_text) if len(desc_text) >= 3 else None
+        for candidate in (merchant, line_desc):
+            if not desc and candidate and len(candidate) >= 3:
+                desc = candidate
+        if not desc and party and len(party) >= 3:
+            desc = _first_sentence(f"Transfer ke {party}")
+        return {
+            "bank": self.name or None,
+            "amount": amount,
+            "desc": desc or None,
+            "berita_empty": desc_parts is not None and len(desc_text) < 3,
+        }
+
+
+# ---------- Registry ----------
+
+_REGISTRY: dict[str, ReceiptFormat] = {}
+# phrases that contain a keyword without naming the issuer: "dana" is also the
+# Indonesian word for funds, so bank receipts say "Sumber Dana", "Transfer Dana", …
+_IGNORED = (
+    "SUMBER DANA", "TRANSFER DANA", "PENARIKAN DANA", "TARIK DANA", "SETOR DANA", "SETORAN DANA",
+    "PENGIRIMAN DANA", "KIRIM DANA", "PEMINDAHAN DANA", "PEMINDAHBUKUAN DANA", "DANA MASUK",
+    "DANA KELUAR", "DANA DITERIMA", "DANA TERKIRIM",
+)
+# (compiled scanner, normalized keyword -> format name or None); rebuilt after register()
+_scanner: tuple[re.Pattern, dict[str, str | None]] | None = None
+# used when no format is detected
+_GENERIC = ReceiptFormat("", ())
+
+
+def register(fmt: ReceiptFormat) -> ReceiptFormat:
+    """Add (or replace) a receipt format."""
+    global _scanner
+    _REGISTRY[fmt.name] = fmt
+    _scanner = None
+    return fmt
+
+
+def formats() -> list[ReceiptFormat]:
+    return list(_REGISTRY.values())
+
+
+def _trie_pattern(words) -> str:
+    """One alternation for ``words`` with shared prefixes factored out."""
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        alts = [
+            (r"\s+" if ch == " " else re.escape(ch)) + emit(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not alts:
+            return ""
+        if "" in node:
+            return f"(?:{'|'.join(alts)})?"
+        return alts[0] if len(alts) == 1 else f"(?:{'|'.join(alts)})"
+
+    return emit(trie)
+
+
+def _build_scanner() -> tuple[re.Pattern, dict[str, str | None]]:
+    owners: dict[str, str | None] = {}
+    for fmt in _REGISTRY.values():
+        for kw in fmt.keywords:
+            owners[" ".join(kw.upper().split())] = fmt.name
+    for phrase in _IGNORED:
+        owners[phrase] = None
+    pattern = re.compile(rf"(?<![A-Z0-9])(?:{_trie_pattern(owners)})(?![A-Z0-9])")
+    return pattern, owners
+
+
+def detect(text: str) -> str | None:
+    """Name of the format whose keywords score highest in ``text`` (ties: earliest hit)."""
+    global _scanner
+    scanner = _scanner
+    if scanner is None:
+        scanner = _scanner = _build_scanner()
+    pattern, owners = scanner
+    hits: dict[str, list] = {}
+    for m in pattern.finditer((text or "").upper()):
+        name = owners.get(" ".join(m.group().split()))
+        if name is None:
+            continue
+        hit = hits.get(name)
+        if hit is None:
+            hits[name] = [_REGISTRY[name].weight, m.start()]
+        else:
+            hit[0] += _REGISTRY[name].weight
+    if not hits:
+        return None
+    return max(hits, key=lambda n: (hits[n][0], -hits[n][1]))
+
+
+def parse(text: str) -> dict:
+    """Detect the format of ``text`` and parse it; unknown receipts use the generic labels."""
+    name = detect(text)
+    return (_REGISTRY[name] if name else _GENERIC).parse(text)
+
+
+def account_name(name: str | None) -> str | None:
+    """``name`` if receipts of that format identify the paying bank/wallet, else None."""
+    fmt = _REGISTRY.get(name or "")
+    return fmt.name if fmt is not None and fmt.account else None
+
+
+register(ReceiptFormat("BCA", ("BCA", "BANK CENTRAL ASIA", "KLIKBCA", "BCA MOBILE", "M-BCA", "M-TRANSFER")))
+register(ReceiptFormat("Mandiri", ("MANDIRI", "BANK MANDIRI", "LIVIN")))
+register(ReceiptFormat("BNI", ("BNI", "BNI MOBILE BANKING", "BANK NEGARA INDONESIA")))
+register(ReceiptFormat("BRI", ("BRI", "BRIMO", "BANK RAKYAT INDONESIA")))
+register(ReceiptFormat(
+    "GoPay", ("GOPAY", "GOJEK"),
+    desc_lines=(r"GO(?:FOOD|RIDE|CAR|SEND|MART|SHOP|TIX)\b",),
+))
+register(ReceiptFormat("OVO", ("OVO",)))
+register(ReceiptFormat("DANA", ("DANA",)))
+register(ReceiptFormat("QRIS", ("QRIS",), weight=0.5, account=False))
@@ -0,0 +1,186 @@
+"""Write-behind queue for new transactions.
+
+With ``WRITE_BEHIND`` enabled, a save is appended to a local SQLite spool
+(fsync'd) and acknowledged right away; a background writer sends the spool to
+Supabase in multi-row batches every ``SPOOL_FLUSH_INTERVAL`` seconds and
+deletes rows only after the insert succeeded. Each row carries a
+client-generated ``id`` and is upserted with ``on conflict (id) do nothing``,
+so replaying rows after a crash never duplicates them. Anything left in the
+spool is replayed on startup.
+
+A batch Supabase rejects for good (e.g. a category deleted since it was
+cached) is retried row by row; rows that still fail are moved to the
+``dead`` table and logged so they do not hold up the rows behind them.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import db
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "").lower() in {"1", "true", "yes"}
+SPOOL_PATH = os.getenv("SPOOL_PATH", "spool.sqlite3")
+SPOOL_FLUSH_INTERVAL = float(os.getenv("SPOOL_FLUSH_INTERVAL", "1.0"))
+SPOOL_BATCH_SIZE = int(os.getenv("SPOOL_BATCH_SIZE", "500"))
+_MAX_BACKOFF = 60.0
+
+_conn: sqlite3.Connection | None = None
+_conn_lock = threading.Lock()
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(SPOOL_PATH, check_same_thread=False, isolation_level=None)
+        _conn.execute("pragma journal_mode=wal")
+        _conn.execute("pragma synchronous=full")
+        _conn.execute(
+            "create table if not exists pending (seq integer primary key autoincrement, payload text not null)"
+        )
+        _conn.execute(
+            "create table if not exists dead "
+            "(seq integer primary key, payload text not null, error text, failed_at real not null)"
+        )
+    return _conn
+
+
+def _append(raw: str) -> None:
+    with _conn_lock:
+        _db().execute("insert into pending (payload) values (?)", (raw,))
+
+
+def _peek(limit: int) -> list[tuple[int, str]]:
+    with _conn_lock:
+        return _db().execute("select seq, payload from pending order by seq limit ?", (limit,)).fetchall()
+
+
+def _ack(last_seq: int) -> None:
+    with _conn_lock:
+        _db().execute("delete from pending where seq <= ?", (last_seq,))
+
+
+def _ack_one(seq: int) -> None:
+    with _conn_lock:
+        _db().execute("delete from pending where seq = ?", (seq,))
+
+
+def _bury(seq: int, raw: str, error: str) -> None:
+    with _conn_lock:
+        conn = _db()
+        conn.execute("begin immediate")
+        try:
+            conn.execute(
+                "insert or replace into dead (seq, payload, error, failed_at) values (?, ?, ?, ?)",
+                (seq, raw, error, time.time()),
+            )
+            conn.execute("delete from pending where seq = ?", (seq,))
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+
+
+def pending_count() -> int:
+    with _conn_lock:
+        return _db().execute("select count(*) from pending").fetchone()[0]
+
+
+def dead_count() -> int:
+    with _conn_lock:
+        return _db().execute("select count(*) from dead").fetchone()[0]
+
+
+def _ensure_writer() -> asyncio.Event:
+    global _wakeup, _task
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(_writer())
+    return _wakeup
+
+
+async def enqueue(payload: dict) -> dict:
+    """Durably spool one transaction row; returns the payload with its ``id``."""
+    payload = dict(payload)
+    payload.setdefault("id", str(uuid.uuid4()))
+    await asyncio.to_thread(_append, json.dumps(payload))
+    _ensure_writer().set()
+    return payload
+
+
+async def flush() -> int:
+    """Send everything currently spooled; returns the number of rows sent."""
+    sent = 0
+    while True:
+        rows = await asyncio.to_thread(_peek, SPOOL_BATCH_SIZE)
+        if not rows:
+            return sent
+        try:
+            await db.upsert_transactions([json.loads(raw) for _, raw in rows])
+        except Exception as e:
+            if not db.rejects_row(e):
+                raise
+            sent += await _flush_one_by_one(rows)
+            continue
+        await asyncio.to_thread(_ack, rows[-1][0])
+        sent += len(rows)
+
+
+async def _flush_one_by_one(rows: list[tuple[int, str]]) -> int:
+    """Send a rejected batch row by row, moving the rows Supabase refuses to ``dead``."""
+    sent = 0
+    for seq, raw in rows:
+        try:
+            await db.upsert_transactions([json.loads(raw)])
+        except Exception as e:
+            if not db.rejects_row(e):
+                raise
+            logging.error("spool: row %d rejected (%s), moved to dead: %s", seq, e, raw)
+            await asyncio.to_thread(_bury, seq, raw, repr(e))
+            continue
+        await asyncio.to_thread(_ack_one, seq)
+        sent += 1
+    return sent
+
+
+async def _writer() -> None:
+    backoff = SPOOL_FLUSH_INTERVAL
+    while True:
+        await _wakeup.wait()
+        # let concurrent saves pile up into one batch
+        await asyncio.sleep(SPOOL_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            sent = await flush()
+            if sent:
+                logging.info("spool: sent %d row(s)", sent)
+            backoff = SPOOL_FLUSH_INTERVAL
+        except Exception:
+            logging.exception("spool flush failed; retrying in %.0fs", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF)
+            _wakeup.set()
+
+
+def start() -> None:
+    """Start the writer and replay rows left over from a previous run."""
+    _ensure_writer().set()
+
+
+async def stop() -> None:
+    """Stop the writer after a last best-effort flush."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    try:
+        await flush()
+    except Exception:
+        logging.exception("spool: final flush failed, rows stay spooled for next start")
@@ -0,0 +1,25 @@
+-- Income/outcome/balance for one user, optionally limited to [p_from, p_to).
+-- Used by /summary via supabase.rpc("transaction_summary", ...).
+
+create index if not exists transaction_user_date_idx
+  on "transaction" (user_id, transaction_date);
+
+create or replace function transaction_summary(
+  p_user_id uuid,
+  p_from timestamptz default null,
+  p_to timestamptz default null
+)
+returns table (income numeric, outcome numeric, balance numeric)
+language sql
+stable
+as $$
+  select
+    coalesce(sum(amount) filter (where type = 'income'), 0)  as income,
+    coalesce(sum(amount) filter (where type = 'outcome'), 0) as outcome,
+    coalesce(sum(amount) filter (where type = 'income'), 0)
+      - coalesce(sum(amount) filter (where type = 'outcome'), 0) as balance
+  from "transaction"
+  where user_id = p_user_id
+    and (p_from is null or transaction_date >= p_from)
+    and (p_to is null or transaction_date < p_to);
+$$;
@@ -0,0 +1,140 @@
+-- Running income/outcome totals per user and per user-month, kept current by
+-- a trigger on "transaction" so /summary reads a single row by primary key.
+
+-- Month boundaries are taken in this zone; keep it equal to APP_TIMEZONE.
+create or replace function cashflow_month(p_ts timestamptz)
+returns date
+language sql
+immutable
+as $$
+  select date_trunc('month', p_ts at time zone 'Asia/Jakarta')::date;
+$$;
+
+create table if not exists user_balance (
+  user_id uuid primary key references app_user(id) on delete cascade,
+  income numeric not null default 0,
+  outcome numeric not null default 0,
+  balance numeric generated always as (income - outcome) stored,
+  updated_at timestamptz not null default now()
+);
+
+create table if not exists user_balance_month (
+  user_id uuid not null references app_user(id) on delete cascade,
+  month date not null,  -- first day of the month in the app timezone
+  income numeric not null default 0,
+  outcome numeric not null default 0,
+  balance numeric generated always as (income - outcome) stored,
+  updated_at timestamptz not null default now(),
+  primary key (user_id, month)
+);
+
+create or replace function user_balance_apply(
+  p_user_id uuid, p_ts timestamptz, p_type text, p_amount numeric, p_sign int
+)
+returns void
+language plpgsql
+as $$
+declare
+  v_income numeric := case when p_type = 'income' then coalesce(p_amount, 0) * p_sign else 0 end;
+  v_outcome numeric := case when p_type = 'outcome' then coalesce(p_amount, 0) * p_sign else 0 end;
+begin
+  if p_user_id is null then
+    return;
+  end if;
+  insert into user_balance as b (user_id, income, outcome)
+  values (p_user_id, v_income, v_outcome)
+  on conflict (user_id) do update
+    set income = b.income + excluded.income,
+        outcome = b.outcome + excluded.outcome,
+        updated_at = now();
+  insert into user_balance_month as b (user_id, month, income, outcome)
+  values (p_user_id, cashflow_month(p_ts), v_income, v_outcome)
+  on conflict (user_id, month) do update
+    set income = b.income + excluded.income,
+        outcome = b.outcome + excluded.outcome,
+        updated_at = now();
+end;
+$$;
+
+create or replace function user_balance_trg()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    perform user_balance_apply(old.user_id, old.transaction_date, old.type::text, old.amount, -1);
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    perform user_balance_apply(new.user_id, new.transaction_date, new.type::text, new.amount, 1);
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists transaction_user_balance on "transaction";
+create trigger transaction_user_balance
+  after insert or update or delete on "transaction"
+  for each row execute function user_balance_trg();
+
+-- Rebuild the totals from "transaction" (one user, or everyone when null) and
+-- return the (user, month) rows whose stored totals had drifted. A one-user
+-- rebuild locks only that user's user_balance row: the trigger's upsert waits
+-- on it, so other users keep saving while /reconcile runs.
+create or replace function user_balance_reconcile(p_user_id uuid default null)
+returns table (user_id uuid, month date, income_drift numeric, outcome_drift numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  -- hold off concurrent trigger updates while rebuilding
+  if p_user_id is null then
+    lock table "transaction" in share mode;
+  else
+    insert into user_balance (user_id) values (p_user_id) on conflict (user_id) do nothing;
+    perform 1 from user_balance where user_balance.user_id = p_user_id for update;
+  end if;
+
+  create temp table _actual on commit drop as
+    select t.user_id,
+           cashflow_month(t.transaction_date) as month,
+           coalesce(sum(t.amount) filter (where t.type::text = 'income'), 0) as income,
+           coalesce(sum(t.amount) filter (where t.type::text = 'outcome'), 0) as outcome
+    from "transaction" t
+    where t.user_id is not null
+      and (p_user_id is null or t.user_id = p_user_id)
+    group by 1, 2;
+
+  return query
+    select coalesce(a.user_id, m.user_id),
+           coalesce(a.month, m.month),
+           coalesce(a.income, 0) - coalesce(m.income, 0),
+           coalesce(a.outcome, 0) - coalesce(m.outcome, 0)
+    from _actual a
+    full join (
+      select * from user_balance_month
+      where p_user_id is null or user_balance_month.user_id = p_user_id
+    ) m on a.user_id = m.user_id and a.month = m.month
+    where coalesce(a.income, 0) <> coalesce(m.income, 0)
+       or coalesce(a.outcome, 0) <> coalesce(m.outcome, 0);
+
+  delete from user_balance_month where p_user_id is null or user_balance_month.user_id = p_user_id;
+  insert into user_balance_month (user_id, month, income, outcome)
+    select user_id, month, income, outcome from _actual;
+
+  if p_user_id is null then
+    delete from user_balance;
+    insert into user_balance (user_id, income, outcome)
+      select user_id, sum(income), sum(outcome) from _actual group by user_id;
+  else
+    -- update in place: the locked row is what concurrent saves are waiting on
+    update user_balance
+      set income = coalesce((select sum(a.income) from _actual a), 0),
+          outcome = coalesce((select sum(a.outcome) from _actual a), 0),
+          updated_at = now()
+      where user_balance.user_id = p_user_id;
+  end if;
+end;
+$$;
+
+-- initial fill
+select count(*) from user_balance_reconcile();
@@ -0,0 +1,28 @@
+-- Income/outcome per category and per bank for one user in [p_from, p_to).
+-- One scan of "transaction"; grouping sets produce both breakdowns.
+-- Used by /report via supabase.rpc("transaction_report", ...).
+
+create or replace function transaction_report(
+  p_user_id uuid,
+  p_from timestamptz default null,
+  p_to timestamptz default null
+)
+returns table (dimension text, name text, income numeric, outcome numeric, tx_count bigint)
+language sql
+stable
+as $$
+  select
+    case when grouping(c.name) = 0 then 'category' else 'bank' end as dimension,
+    coalesce(case when grouping(c.name) = 0 then c.name else b.name end, '-') as name,
+    coalesce(sum(t.amount) filter (where t.type::text = 'income'), 0) as income,
+    coalesce(sum(t.amount) filter (where t.type::text = 'outcome'), 0) as outcome,
+    count(*) as tx_count
+  from "transaction" t
+  left join category c on c.id = t.category_id
+  left join bank b on b.id = t.bank_id
+  where t.user_id = p_user_id
+    and (p_from is null or t.transaction_date >= p_from)
+    and (p_to is null or t.transaction_date < p_to)
+  group by grouping sets ((c.name), (b.name))
+  order by 1 desc, 4 desc, 3 desc;
+$$;
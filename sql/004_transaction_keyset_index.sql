@@ -0,0 +1,3 @@
+-- Keyset paging for /list: newest first by (transaction_date, id) per user.
+create index if not exists transaction_user_date_id_idx
+  on "transaction" (user_id, transaction_date desc, id desc);
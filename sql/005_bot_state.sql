@@ -0,0 +1,7 @@
+-- Conversation states and user_data shared by all bot instances (persistence.py).
+-- key is 'user:<telegram user id>' or 'conv:<handler name>:<chat id>:<user id>'.
+create table if not exists bot_state (
+  key        text primary key,
+  value      jsonb not null,
+  updated_at timestamptz not null default now()
+);
@@ -0,0 +1,153 @@
+"""Shared bank/category taxonomy cache.
+
+Both tables are small and global, so each one is loaded whole into a
+normalized-name -> id map and refreshed every ``TAXONOMY_CACHE_TTL`` seconds.
+Names the map does not know are created with a single upsert on ``name``.
+The same load also yields the ordered name list behind the numbered pickers.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+import db
+
+TAXONOMY_CACHE_TTL = float(os.getenv("TAXONOMY_CACHE_TTL", "300"))
+TABLES = ("bank", "category")
+
+
+def normalize_name(name: str | None) -> str:
+    """Cache key for a bank/category name: 'BCA ', 'bca' and 'Bca' are equal."""
+    return " ".join((name or "").split()).casefold()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Ordered names of one table plus the pre-rendered '1) name' menu lines."""
+    version: int
+    names: tuple[str, ...]
+    menu: str
+
+
+def _render_menu(names: tuple[str, ...]) -> str:
+    return "\n".join(f"{i}) {n}" for i, n in enumerate(names, 1))
+
+
+class _TableCache:
+    def __init__(self, table: str):
+        self.table = table
+        self.ids: dict[str, str] = {}
+        self.names_by_id: dict[str, str] = {}
+        self.snapshot = Snapshot(0, (), "")
+        self.loaded_at: float | None = None
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < TAXONOMY_CACHE_TTL
+
+
+_caches = {t: _TableCache(t) for t in TABLES}
+
+
+async def _ensure_loaded(c: _TableCache) -> None:
+    if c.fresh():
+        return
+    async with c.lock:
+        if c.fresh():
+            return
+        rows = await db.fetch_id_names(c.table)
+        ids: dict[str, str] = {}
+        for r in rows:
+            # keep the first row if names only differ by case/spacing
+            ids.setdefault(normalize_name(r["name"]), r["id"])
+        names = tuple(r["name"] for r in rows)
+        c.ids = ids
+        c.names_by_id = {r["id"]: r["name"] for r in rows}
+        if names != c.snapshot.names:
+            c.snapshot = Snapshot(c.snapshot.version + 1, names, _render_menu(names))
+        c.loaded_at = time.monotonic()
+
+
+async def resolve_id(table: str, name: str) -> str:
+    """Return the id of ``name`` in ``table``, creating the row if needed."""
+    c = _caches[table]
+    key = normalize_name(name)
+    if not key:
+        raise ValueError(f"Nama {table} tidak boleh kosong")
+    await _ensure_loaded(c)
+    found = c.ids.get(key)
+    if found:
+        c.hits += 1
+        return found
+    c.misses += 1
+    new_id = await db.upsert_name(table, " ".join(name.split()))
+    if not new_id:
+        raise RuntimeError(f"Gagal membuat {table} '{name}'")
+    c.ids[key] = new_id
+    c.names_by_id[new_id] = " ".join(name.split())
+    # new row: the picker snapshot is stale, reload it on next use
+    c.loaded_at = None
+    return new_id
+
+
+async def resolve_ids(table: str, names) -> dict[str, str]:
+    """Bulk :func:`resolve_id`: name -> id for every name, creating all misses in one upsert."""
+    c = _caches[table]
+    await _ensure_loaded(c)
+    missing: dict[str, str] = {}
+    for name in names:
+        key = normalize_name(name)
+        if key and key not in c.ids:
+            missing.setdefault(key, " ".join(name.split()))
+    if missing:
+        c.misses += len(missing)
+        for r in await db.upsert_names(table, list(missing.values())):
+            c.ids.setdefault(normalize_name(r["name"]), r["id"])
+            c.names_by_id[r["id"]] = r["name"]
+        c.loaded_at = None
+    out: dict[str, str] = {}
+    for name in names:
+        found = c.ids.get(normalize_name(name))
+        if not found:
+            raise RuntimeError(f"Gagal membuat {table} '{name}'")
+        out[name] = found
+    return out
+
+
+async def snapshot(table: str) -> Snapshot:
+    """Current picker snapshot for ``table``; no DB call while it is fresh."""
+    c = _caches[table]
+    await _ensure_loaded(c)
+    return c.snapshot
+
+
+async def lookup_id(table: str, name: str) -> str | None:
+    """Id of an existing ``name`` in ``table`` (never creates)."""
+    c = _caches[table]
+    await _ensure_loaded(c)
+    return c.ids.get(normalize_name(name))
+
+
+async def names_by_id(table: str, ids) -> dict[str, str]:
+    """id -> name for ``ids``; reloads once if any id is unknown (created elsewhere)."""
+    c = _caches[table]
+    await _ensure_loaded(c)
+    if any(i and i not in c.names_by_id for i in ids):
+        c.loaded_at = None
+        await _ensure_loaded(c)
+    return c.names_by_id
+
+
+def invalidate(table: str | None = None) -> None:
+    """Drop cached taxonomy so the next lookup reloads from the database."""
+    for t in ((table,) if table else TABLES):
+        _caches[t].loaded_at = None
+
+
+def stats() -> dict:
+    return {
+        t: {"size": len(c.ids), "hits": c.hits, "misses": c.misses, "version": c.snapshot.version}
+        for t, c in _caches.items()
+    }